@@ -0,0 +1,412 @@
+"""
+Functions for processing directories of sediment core images without the GUI,
+as part of the Sediment Core Analysis project for CITS3200 at UWA.
+
+This module must not import PyQt6 or a Qt matplotlib backend, so that it can
+run on machines without a display.
+
+Date: October 2024
+"""
+import os
+import glob
+import json
+import time
+import hashlib
+import argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+import app.utils.ImageTransforming as transform
+from app.utils.ProcessSedimentCore import process_core_image, get_processing_parameters, Scaling
+from app.utils.ProfileCache import ProfileCache
+from app.utils.CoreProfile import CoreProfile
+
+image_extensions = ('.png', '.jpg', '.jpeg', '.bmp')
+summary_file_name = 'summary.csv'
+manifest_file_name = 'manifest.json'
+summary_columns = ["Image", "Status", "Profile", "Length (mm)", "Scale", "Bounding Box", "Layers", "Seconds"]
+
+def find_images(paths: list, recursive: bool=False) -> list:
+    """
+    Returns the image files found in a list of files, directories and glob patterns.
+
+    Parameters:
+        paths (list): image files, directories of images or glob patterns (e.g. `'scans/*.jpg'`)
+        recursive (bool): whether to search the subdirectories of directories
+
+    Returns:
+        image_paths (list): the image paths, in the order they were found, without duplicates
+    """
+    image_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            pattern = os.path.join(path, '**', '*') if recursive else os.path.join(path, '*')
+            found = sorted(glob.glob(pattern, recursive=recursive))
+        elif os.path.isfile(path):
+            found = [path]
+        else:
+            found = sorted(glob.glob(path, recursive=True))
+        for image_path in found:
+            if os.path.isfile(image_path) and image_path.lower().endswith(image_extensions):
+                image_paths.append(os.path.abspath(image_path))
+    return list(dict.fromkeys(image_paths))
+
+def get_output_names(image_paths: list, manifest: dict=None, reserved_names: set=frozenset()) -> dict:
+    """
+    Returns the name of the profile file for each image. Images with the same file name
+    in different directories are prefixed with the name of their directory.
+
+    An image already in the manifest keeps the name of its profile. A name that is used
+    by the profile of another image in the manifest, or is in `reserved_names` (such as
+    profiles still being written), is suffixed with a short hash of the image path instead,
+    so a run never overwrites the profile of an image from another run.
+    """
+    manifest = manifest if manifest is not None else {}
+    taken = {image_path: os.path.basename(entry["Summary"]["Profile"]) for image_path, entry in manifest.items()
+             if entry["Summary"]["Profile"] is not None}
+    stems = [os.path.splitext(os.path.basename(image_path))[0] for image_path in image_paths]
+    output_names = {image_path: taken[image_path] for image_path in image_paths if image_path in taken}
+    used = set(taken.values()) | set(output_names.values()) | set(reserved_names)
+    for image_path, stem in zip(image_paths, stems):
+        if image_path in output_names:
+            continue
+        if stems.count(stem) > 1:
+            stem = f'{os.path.basename(os.path.dirname(image_path))}_{stem}'
+        if f'{stem}.csv' in used:
+            stem = f'{stem}-{hashlib.sha256(image_path.encode()).hexdigest()[:8]}'
+        output_names[image_path] = f'{stem}.csv'
+        used.add(output_names[image_path])
+    return {image_path: output_names[image_path] for image_path in image_paths}
+
+def process_image_file(image_path: str, output_path: str, core_width_mm: int=76,
+                       pyramid_level: int=2, colour_spaces: tuple=CoreProfile.default_colour_spaces,
+                       pixel_lab: bool=False) -> dict:
+    """
+    Processes one sediment core image and writes its profile in the given colour spaces
+    (by default RGB and CIELAB) to a CSV file. If `pixel_lab` is `True`, the CIELAB colours
+    are the averages of the CIELAB colours of the pixels rather than of the average colours.
+
+    Failures are recorded in the returned summary instead of being raised, so that one
+    bad image does not stop a batch.
+
+    Returns:
+        summary (dict): the image path, status, profile path, length, scale,
+        bounding box, number of layers and processing time of the image
+    """
+    start = time.perf_counter()
+    summary = {
+        "Image": image_path,
+        "Status": "processed",
+        "Profile": None,
+        "Length (mm)": None,
+        "Scale": None,
+        "Bounding Box": None,
+        "Layers": 0
+    }
+    try:
+        image = transform.import_image(image_path)
+        core = process_core_image(transform.orient_array(image), core_width_mm, df=False, pyramid_level=pyramid_level,
+                                  pixel_lab=pixel_lab)
+        if core == 0:
+            summary["Status"] = "no core detected"
+        else:
+            profile = CoreProfile.from_colours(core['Colours'], core['Scale'], core.get('Lab'))
+            profile.to_dataframe(colour_spaces).to_csv(output_path, index=False)
+            summary.update({
+                "Profile": output_path,
+                "Length (mm)": core['Length (mm)'],
+                "Scale": core['Scale'],
+                "Bounding Box": [int(value) for value in core['Bounding Box']],
+                "Layers": len(profile)
+            })
+    except Exception as error:
+        summary["Status"] = f"failed: {error}"
+    summary["Seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+def load_manifest(output_dir: str) -> dict:
+    """ Returns the manifest of a previous batch run in an output directory (empty if there is none) """
+    try:
+        with open(os.path.join(output_dir, manifest_file_name)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(output_dir: str, manifest: dict) -> None:
+    """ Writes the manifest of a batch run to its output directory """
+    manifest_path = os.path.join(output_dir, manifest_file_name)
+    with open(f'{manifest_path}.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+def get_input_hash(image_path: str, entry: dict=None) -> dict:
+    """
+    Returns the content hash, size and modification time of an image file.
+    The hash in the manifest `entry` is reused if the size and modification time have not changed.
+    """
+    stat = os.stat(image_path)
+    if entry is not None and entry.get("Input Size") == stat.st_size and entry.get("Input Modified") == stat.st_mtime_ns:
+        input_hash = entry["Input Hash"]
+    else:
+        input_hash = ProfileCache.hash_file(image_path)
+    return {"Input Hash": input_hash, "Input Size": stat.st_size, "Input Modified": stat.st_mtime_ns}
+
+def get_batch_parameters(core_width_mm: int, pyramid_level: int, colour_spaces: tuple=CoreProfile.default_colour_spaces,
+                         pixel_lab: bool=False) -> dict:
+    """ Returns the parameters of a batch run, which only include the colour spaces if they are not the default """
+    parameters = get_processing_parameters(core_width_mm, pyramid_level=pyramid_level, pixel_lab=pixel_lab)
+    if tuple(colour_spaces) != CoreProfile.default_colour_spaces:
+        parameters["Colour Spaces"] = list(colour_spaces)
+    return parameters
+
+def get_parameter_hash(core_width_mm: int, pyramid_level: int, colour_spaces: tuple=CoreProfile.default_colour_spaces,
+                       pixel_lab: bool=False) -> str:
+    """ Returns the hash of the parameters of a batch run """
+    return ProfileCache.hash_parameters(get_batch_parameters(core_width_mm, pyramid_level, colour_spaces, pixel_lab))
+
+def is_up_to_date(entry: dict, input_hash: dict, parameter_hash: str) -> bool:
+    """ Returns whether the manifest entry of an image is the result of processing its current contents """
+    if entry is None or entry.get("Input Hash") != input_hash["Input Hash"] or entry.get("Parameter Hash") != parameter_hash:
+        return False
+    status, profile = entry["Summary"]["Status"], entry["Summary"]["Profile"]
+    return status == "no core detected" or (status == "processed" and profile is not None and os.path.exists(profile))
+
+def prune_manifest(manifest: dict) -> int:
+    """
+    Removes the entries of images that no longer exist, returning the number removed.
+    Their profiles are deleted unless another entry in the manifest still refers to them.
+    """
+    removed = [manifest.pop(image_path) for image_path in list(manifest) if not os.path.exists(image_path)]
+    remaining = {entry["Summary"]["Profile"] for entry in manifest.values()}
+    for entry in removed:
+        profile = entry["Summary"]["Profile"]
+        if profile is not None and profile not in remaining and os.path.exists(profile):
+            os.remove(profile)
+    return len(removed)
+
+def run_batch(image_paths: list, output_dir: str, core_width_mm: int=76, workers: int=None,
+              pyramid_level: int=2, incremental: bool=True,
+              colour_spaces: tuple=CoreProfile.default_colour_spaces, pixel_lab: bool=False) -> pd.DataFrame:
+    """
+    Processes a list of sediment core images in a pool of processes, writing one
+    profile per image and a summary table (`summary.csv`) to the output directory.
+
+    A manifest (`manifest.json`) of the content hash of each image, the hash of the
+    processing parameters and the profile location is kept in the output directory.
+    If `incremental` is `True`, images whose contents and parameters have not changed 
+    since the last run are skipped. The profiles of images that have been deleted 
+    are always removed.
+
+    Parameters:
+        image_paths (list): the paths of the images to process
+        output_dir (str): the directory to write the profiles and summary to
+        core_width_mm (int): the width of the sediment cores in millimeters
+        workers (int): the number of processes (if `None`, one per CPU; if 1, no pool is used)
+        pyramid_level (int): the pyramid level used to detect the cores
+        incremental (bool): whether to skip images that are up to date in the manifest
+        colour_spaces (tuple): the colour spaces written to the profiles (from `'BGR'`, `'Lab'`, `'HSV'`, `'XYZ'` and `'Grey'`)
+        pixel_lab (bool): whether to average the CIELAB colours of the pixels of each layer
+
+    Returns:
+        summary (pd.DataFrame): a row for each image, in the order of `image_paths`. 
+        The number of pruned images is stored in `summary.attrs['Pruned']`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    parameters = get_batch_parameters(core_width_mm, pyramid_level, colour_spaces, pixel_lab)
+    parameter_hash = ProfileCache.hash_parameters(parameters)
+    output_names = get_output_names(image_paths, manifest)
+
+    rows, jobs, input_hashes = {}, [], {}
+    for image_path in image_paths:
+        entry = manifest.get(image_path)
+        try:
+            input_hashes[image_path] = get_input_hash(image_path, entry)
+        except OSError:
+            input_hashes[image_path] = None
+        if incremental and input_hashes[image_path] is not None and is_up_to_date(entry, input_hashes[image_path], parameter_hash):
+            rows[image_path] = dict(entry["Summary"], Status="skipped", Seconds=0.)
+        else:
+            jobs.append((image_path, os.path.join(output_dir, output_names[image_path]), core_width_mm, pyramid_level, colour_spaces, pixel_lab))
+
+    if workers == 1 or len(jobs) <= 1:
+        results = [process_image_file(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process_image_file, *zip(*jobs)))
+
+    for result in results:
+        image_path = result["Image"]
+        rows[image_path] = result
+        if input_hashes[image_path] is not None:
+            manifest[image_path] = dict(input_hashes[image_path], **{"Parameter Hash": parameter_hash,
+                                                                     "Parameters": parameters, "Summary": result})
+
+    pruned = prune_manifest(manifest)
+    save_manifest(output_dir, manifest)
+
+    summary = pd.DataFrame([rows[image_path] for image_path in image_paths], columns=summary_columns)
+    summary.to_csv(os.path.join(output_dir, summary_file_name), index=False)
+    summary.attrs['Pruned'] = pruned
+    return summary
+
+def recalibrate_batch(output_dir: str, core_widths: dict, pyramid_level: int=2,
+                     colour_spaces: tuple=CoreProfile.default_colour_spaces, pixel_lab: bool=False) -> pd.DataFrame:
+    """
+    Changes the core width of images that have already been processed into an output directory,
+    without processing them again. Only the depths, length and scale of a core depend on its width,
+    so the depths in each profile are rescaled and the length and scale are found from the
+    bounding box in the manifest.
+
+    The manifest then records each profile as processed with its other parameters unchanged
+    and the new width, so later runs with that width skip it. Manifests written before the
+    parameters were stored in each entry only record their hash, so the other parameters are
+    given instead, and an image is not recalibrated unless they reproduce that hash.
+
+    Parameters:
+        output_dir (str): the output directory of the batch run that processed the images
+        core_widths (dict): the new width of the core (in millimeters) of each image path
+        pyramid_level (int): the pyramid level of entries that do not store their parameters
+        colour_spaces (tuple): the colour spaces of entries that do not store their parameters
+        pixel_lab (bool): whether entries that do not store their parameters averaged the pixels in CIELAB
+
+    Returns:
+        summary (pd.DataFrame): a row for each image in `core_widths`, with the status `'recalibrated'`,
+        `'not processed'` if it has no profile in the output directory, or `'parameters differ'`
+        if the given parameters are not the ones its profile was made with
+    """
+    manifest = load_manifest(output_dir)
+    rows = {}
+    for image_path, core_width_mm in core_widths.items():
+        start = time.perf_counter()
+        image_path = os.path.abspath(image_path)
+        entry = manifest.get(image_path)
+        result = entry["Summary"] if entry is not None else {}
+        if result.get("Status") != "processed" or result.get("Profile") is None or not os.path.exists(result["Profile"]):
+            rows[image_path] = {"Image": image_path, "Status": "not processed", "Layers": 0}
+            continue
+
+        parameters = entry.get("Parameters")
+        if parameters is None:
+            old_width = round(result["Scale"] * min(result["Bounding Box"][2:]))
+            if get_parameter_hash(old_width, pyramid_level, colour_spaces, pixel_lab) != entry["Parameter Hash"]:
+                rows[image_path] = dict(result, Status="parameters differ", Seconds=0.)
+                continue
+            parameters = get_batch_parameters(old_width, pyramid_level, colour_spaces, pixel_lab)
+
+        scaling = Scaling(core_width_mm)
+        length = scaling.get_core_length(result["Bounding Box"])
+        profile = pd.read_csv(result["Profile"])
+        profile['Depth (mm)'] *= scaling.scale / result["Scale"]
+        temp_path = f'{result["Profile"]}.tmp'
+        profile.to_csv(temp_path, index=False)
+        os.replace(temp_path, result["Profile"])
+
+        result.update({"Length (mm)": length, "Scale": scaling.scale})
+        entry["Parameters"] = dict(parameters, **{"Core Width (mm)": core_width_mm})
+        entry["Parameter Hash"] = ProfileCache.hash_parameters(entry["Parameters"])
+        rows[image_path] = dict(result, Status="recalibrated", Seconds=round(time.perf_counter() - start, 3))
+    save_manifest(output_dir, manifest)
+
+    # The summary of the last run shows the new lengths and scales
+    summary_path = os.path.join(output_dir, summary_file_name)
+    if os.path.exists(summary_path):
+        last_run = pd.read_csv(summary_path)
+        for index, image_path in last_run["Image"].items():
+            if rows.get(image_path, {}).get("Status") == "recalibrated":
+                last_run.loc[index, ["Length (mm)", "Scale"]] = [rows[image_path]["Length (mm)"], rows[image_path]["Scale"]]
+        last_run.to_csv(summary_path, index=False)
+
+    return pd.DataFrame(list(rows.values()), columns=summary_columns)
+
+def get_run_report(summary: pd.DataFrame) -> str:
+    """ Returns a short report of the number of processed, skipped, failed and pruned images and their timings """
+    status = summary["Status"]
+    processed = summary[status == "processed"]
+    failed = summary[~status.isin(["processed", "skipped"])]
+    report = (f"{len(processed)} processed, {(status == 'skipped').sum()} skipped, "
+              f"{len(failed)} failed, {summary.attrs.get('Pruned', 0)} pruned")
+    if len(processed) > 0:
+        report += (f"\nProcessing took {processed['Seconds'].sum():.1f} s "
+                   f"({processed['Seconds'].mean():.2f} s per image, slowest {processed['Seconds'].max():.2f} s)")
+    for _, row in failed.iterrows():
+        report += f"\n  {row['Image']}: {row['Status']} ({row['Seconds']:.2f} s)"
+    return report
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    """ Returns the command line argument parser for batch processing """
+    parser = argparse.ArgumentParser(
+        description="Process directories of sediment core images without opening the GUI.")
+    parser.add_argument('paths', nargs='+', help="image files, directories or glob patterns to process")
+    parser.add_argument('-o', '--output', default='profiles', help="directory to write the profiles to")
+    parser.add_argument('-w', '--core-width', type=int, default=76, help="width of the cores in millimeters")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="number of processes (default: one per CPU)")
+    parser.add_argument('-r', '--recursive', action='store_true', help="search subdirectories for images")
+    parser.add_argument('--pyramid-level', type=int, default=2,
+                        help="number of times to halve the image when detecting the core (0 for full resolution)")
+    parser.add_argument('--colour-spaces', nargs='+', default=list(CoreProfile.default_colour_spaces),
+                        choices=list(CoreProfile.colour_space_channels),
+                        help="colour spaces to write to the profiles (default: BGR Lab)")
+    parser.add_argument('--pixel-lab', action='store_true',
+                        help="average the CIELAB colours of the pixels of each layer, rather than converting the average colour")
+    parser.add_argument('--recalibrate', action='store_true',
+                        help="rescale the existing profiles of the images to --core-width instead of processing them again")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="reprocess every image, even if it has not changed since the last run")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep watching a directory and process new scans as they arrive")
+    parser.add_argument('--poll-interval', type=float, default=2., help="seconds between polls in watch mode")
+    parser.add_argument('--settle', type=float, default=5.,
+                        help="seconds a new file must be unchanged before it is processed in watch mode")
+    return parser
+
+def main(argv: list=None) -> int:
+    """ Entry point for batch processing from the command line """
+    args = get_argument_parser().parse_args(argv)
+    if args.watch:
+        return watch(args)
+    image_paths = find_images(args.paths, recursive=args.recursive)
+    if len(image_paths) == 0:
+        print("No images found.")
+        return 1
+
+    start = time.perf_counter()
+    if args.recalibrate:
+        summary = recalibrate_batch(args.output, {image_path: args.core_width for image_path in image_paths},
+                                    pyramid_level=args.pyramid_level, colour_spaces=tuple(args.colour_spaces),
+                                    pixel_lab=args.pixel_lab)
+        recalibrated = (summary["Status"] == "recalibrated").sum()
+        print(f"{recalibrated} recalibrated, {(summary['Status'] == 'not processed').sum()} not processed yet, "
+              f"{(summary['Status'] == 'parameters differ').sum()} processed with other parameters")
+        print(f"Finished in {time.perf_counter() - start:.1f} s (profiles in {args.output})")
+        return 0 if recalibrated == len(summary) else 2
+    summary = run_batch(image_paths, args.output, core_width_mm=args.core_width, workers=args.workers,
+                        pyramid_level=args.pyramid_level, incremental=not args.force,
+                        colour_spaces=tuple(args.colour_spaces), pixel_lab=args.pixel_lab)
+    print(get_run_report(summary))
+    print(f"Finished in {time.perf_counter() - start:.1f} s (profiles and {summary_file_name} written to {args.output})")
+    return 0 if summary["Status"].isin(["processed", "skipped"]).all() else 2
+
+def watch(args: argparse.Namespace) -> int:
+    """ Runs the watch folder ingest mode until it is interrupted """
+    from app.utils.WatchFolder import WatchFolder # imported here as it builds on this module
+
+    if len(args.paths) != 1 or not os.path.isdir(args.paths[0]):
+        print("Watch mode needs exactly one directory to watch.")
+        return 1
+    watcher = WatchFolder(args.paths[0], args.output, core_width_mm=args.core_width,
+                          workers=args.workers or os.cpu_count() or 1, poll_interval=args.poll_interval,
+                          settle_seconds=args.settle, pyramid_level=args.pyramid_level,
+                          colour_spaces=tuple(args.colour_spaces), pixel_lab=args.pixel_lab)
+    print(f"Watching {args.paths[0]} (status in {watcher.status_path}, press Ctrl+C to stop)")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    print(get_watch_report(watcher.get_status()))
+    return 0
+
+def get_watch_report(status: dict) -> str:
+    """ Returns a short report of a watch folder status """
+    return (f"{status['Processed']} processed, {status['Skipped']} skipped, {status['No Core']} without a core, "
+            f"{status['Failed']} failed in {status['Uptime (s)']:.0f} s")
@@ -0,0 +1,138 @@
+"""
+A compact, array-backed colour profile of a sediment core, as part of the
+Sediment Core Analysis project for CITS3200 at UWA.
+
+Date: October 2024
+"""
+import cv2 as cv
+import numpy as np
+import pandas as pd
+
+from app.utils.ImageTransforming import convert_bgr
+
+class CoreProfile():
+    """
+    The depth and colours of each layer of a sediment core.
+
+    The profile is a depth vector and contiguous blocks of colour channels aligned with it
+    by row, so nothing is joined on the floating point depths. The weighted average colours
+    are integers from 0 to 255 and are stored as uint8.
+
+    The other colour spaces (CIELAB, HSV, CIE XYZ and greyscale) are float32 blocks converted
+    from the BGR block in one OpenCV call the first time they are used, then kept, so spaces
+    that are never shown or exported cost nothing and showing one again is free.
+
+    A column is read by name, as with a DataFrame, and is a view of its block rather than
+    a copy.
+
+    Flipping a profile only changes its orientation. The layers are evenly spaced, so the
+    depths measured from the other end of the core are the stored depths in reverse order,
+    and the `'Depth (mm)'` column of a flipped profile is a reversed view of them.
+    Nothing is copied or recalculated, and the stored data is never changed.
+
+    Only the depths depend on the width of the core, so correcting the width rescales
+    the depths in place (`rescale`) rather than processing the image again. `to_dataframe` builds a DataFrame over the blocks for the places that need one,
+    such as exporting the profile to CSV.
+
+    Attributes:
+        depth (np.array): the depth of each layer in millimeters
+        bgr (np.array): the (layers, 3) blue, green and red colours of each layer
+        colour_spaces (dict): the blocks of the colour spaces converted so far
+        flipped (bool): whether the depths are measured from the other end of the core
+    """
+    __slots__ = ('depth', 'bgr', 'colour_spaces', 'flipped')
+
+    # colour space -> names of its channels
+    colour_space_channels = {
+        'BGR': ['Blue', 'Green', 'Red'],
+        'Lab': ['L', 'a', 'b'],
+        'HSV': ['Hue', 'Saturation', 'Value'],
+        'XYZ': ['X', 'Y', 'Z'],
+        'Grey': ['Grey']
+    }
+    default_colour_spaces = ('BGR', 'Lab') # the colour spaces exported unless others are asked for
+    conversions = {
+        'Lab': cv.COLOR_BGR2Lab,
+        'HSV': cv.COLOR_BGR2HSV,
+        'XYZ': cv.COLOR_BGR2XYZ,
+        'Grey': cv.COLOR_BGR2GRAY
+    }
+    # column name -> (colour space, channel)
+    columns = {channel: (colour_space, index) for colour_space, channels in colour_space_channels.items()
+               for index, channel in enumerate(channels)}
+
+    def __init__(self, depth: np.array, bgr: np.array, lab: np.array=None):
+        self.depth = np.ascontiguousarray(depth, dtype=np.float64)
+        self.bgr = np.ascontiguousarray(bgr, dtype=np.uint8)
+        self.colour_spaces = {}
+        self.flipped = False
+        if lab is not None:
+            self.colour_spaces['Lab'] = np.ascontiguousarray(lab, dtype=np.float32)
+
+    @classmethod
+    def from_colours(cls, colours: np.array, scale: float, lab: np.array=None):
+        """
+        Returns the profile of the weighted average BGR colours of the layers of a core
+        (from `Colours.get_weighted_average_layer_colours(df=False)`) that is `scale` millimeters per layer.
+        If `lab` is given (from `Colours.get_weighted_average_layer_lab`), it is used as the CIELAB
+        colours instead of converting the BGR colours.
+        """
+        colours = np.asarray(colours)
+        return cls(np.arange(len(colours)) * scale, np.rint(colours), lab)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame):
+        """ Returns the profile of a DataFrame with a depth column, BGR columns and optionally CIELAB columns """
+        lab = df[['L', 'a', 'b']].to_numpy() if {'L', 'a', 'b'}.issubset(df.columns) else None
+        return cls(df['Depth (mm)'].to_numpy(), np.rint(df[['Blue', 'Green', 'Red']].to_numpy()), lab)
+
+    @property
+    def lab(self) -> np.array:
+        return self.get_colour_space('Lab')
+
+    def get_colour_space(self, colour_space: str) -> np.array:
+        """ Returns the (layers, channels) block of a colour space, converting it from BGR the first time """
+        if colour_space == 'BGR':
+            return self.bgr
+        if colour_space not in self.colour_spaces:
+            self.colour_spaces[colour_space] = convert_bgr(self.bgr, self.conversions[colour_space])
+        return self.colour_spaces[colour_space]
+
+    def get_scale(self) -> float:
+        """ Returns the number of millimeters per layer, the spacing of the (evenly spaced) depths """
+        if len(self) < 2:
+            return 0.
+        return abs(float(self.depth[-1] - self.depth[0])) / (len(self) - 1)
+
+    def rescale(self, scale: float) -> None:
+        """
+        Changes the number of millimeters per layer, e.g. after the width of the core has been corrected.
+        The depths are rescaled in place in one pass, so views of them (such as the depths of a flipped
+        profile) follow, and the colours are unchanged.
+        """
+        old_scale = self.get_scale()
+        if old_scale > 0:
+            self.depth *= scale / old_scale
+
+    def flip(self) -> None:
+        """ Measures the depths from the other end of the core (or back again) """
+        self.flipped = not self.flipped
+
+    def get_depth(self) -> np.array:
+        """ Returns the depth of each layer in the orientation of the profile """
+        return self.depth[::-1] if self.flipped else self.depth
+
+    def __len__(self) -> int:
+        return len(self.depth)
+
+    def __getitem__(self, column: str) -> np.array:
+        """ Returns a column of the profile by name, as a view of its block """
+        if column == 'Depth (mm)':
+            return self.get_depth()
+        colour_space, channel = self.columns[column]
+        return self.get_colour_space(colour_space)[:, channel]
+
+    def to_dataframe(self, colour_spaces: list=default_colour_spaces) -> pd.DataFrame:
+        """ Returns the depth and the channels of the given colour spaces as a DataFrame """
+        columns = ['Depth (mm)'] + [channel for colour_space in colour_spaces for channel in self.colour_space_channels[colour_space]]
+        return pd.DataFrame({column: self[column] for column in columns}, copy=False)
@@ -0,0 +1,51 @@
+"""
+Functions for drawing long colour profiles at a level of detail that matches the
+screen, as part of the Sediment Core Analysis project for CITS3200 at UWA.
+
+Date: October 2024
+"""
+import numpy as np
+
+def get_visible_slice(depth: np.array, lower: float, upper: float) -> slice:
+    """
+    Returns the slice of a monotonic depth array (ascending, or descending once a core is flipped)
+    that lies between `lower` and `upper`, plus one sample either side so lines reach the edges of the axes.
+    """
+    lower, upper = min(lower, upper), max(lower, upper)
+    if len(depth) > 1 and depth[0] > depth[-1]:
+        n = len(depth)
+        visible = get_visible_slice(depth[::-1], lower, upper)
+        return slice(n - visible.stop, n - visible.start)
+    start = max(np.searchsorted(depth, lower, side='left') - 1, 0)
+    stop = min(np.searchsorted(depth, upper, side='right') + 1, len(depth))
+    return slice(int(start), int(max(stop, start)))
+
+def get_min_max_envelope(values: np.array, num_buckets: int) -> np.array:
+    """
+    Returns the indices of the samples to draw so that a line through `values` looks the same
+    when `num_buckets` samples fit on screen: the first, last, minimum and maximum samples
+    of each bucket of neighbouring samples, in their original order. Peaks are never
+    dropped, since every bucket keeps its extremes.
+
+    Returns every index if there are not more than four samples per bucket.
+    """
+    n = len(values)
+    num_buckets = max(int(num_buckets), 1)
+    if n <= 4 * num_buckets:
+        return np.arange(n)
+
+    # Pad the values with their last sample so they divide into buckets of equal size
+    bucket_size = -(-n // num_buckets)
+    num_buckets = -(-n // bucket_size)
+    padded = np.empty(num_buckets * bucket_size, dtype=values.dtype)
+    padded[:n] = values
+    padded[n:] = values[-1]
+    buckets = padded.reshape(num_buckets, bucket_size)
+
+    offsets = np.arange(num_buckets) * bucket_size
+    minimums = offsets + buckets.argmin(axis=1)
+    maximums = offsets + buckets.argmax(axis=1)
+    firsts = offsets
+    lasts = np.minimum(offsets + bucket_size - 1, n - 1)
+    indices = np.concatenate((firsts, lasts, np.minimum(minimums, n - 1), np.minimum(maximums, n - 1)))
+    return np.unique(indices)
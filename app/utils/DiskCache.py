@@ -0,0 +1,91 @@
+"""
+The least recently used on-disk storage shared by the caches of the Sediment Core
+Analysis project for CITS3200 at UWA.
+
+Date: October 2024
+"""
+import os
+import glob
+import threading
+
+class DiskCache():
+    """
+    A directory of cache entries, one file each, whose total size is kept under `max_bytes`
+    by removing the least recently used entries. An entry is marked as used by updating its
+    modification time. Subclasses name the entries and choose what is stored in them.
+
+    The cache is best effort, so failing to read or write an entry is never an error.
+
+    Attributes:
+        cache_dir (str): the directory the cache entries are stored in
+        max_bytes (int): the maximum total size of the cache entries in bytes
+    """
+    default_cache_dir = os.path.join(os.path.expanduser('~'), '.sediment_core_analysis')
+    entry_pattern = '*' # the glob pattern of the entry files in the cache directory
+
+    def __init__(self, cache_dir: str=None, max_bytes: int=256 * 1024**2):
+        self.cache_dir = cache_dir if cache_dir is not None else self.default_cache_dir
+        self.max_bytes = max_bytes
+
+    def write_entry(self, entry_path: str, write, evict: bool=True) -> None:
+        """
+        Writes an entry with `write(path)`, which raises OSError if it fails, then (if `evict` is
+        `True`) evicts the least recently used entries if the cache is too big. The entry is written to a hidden
+        temporary file (with the same extension), which is not matched as an entry, and moved
+        into place, so other threads and processes never read a partial entry.
+        """
+        entry_dir, entry_name = os.path.split(entry_path)
+        temp_path = os.path.join(entry_dir, f'.{entry_name}.{os.getpid()}.{threading.get_ident()}.tmp{os.path.splitext(entry_name)[1]}')
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write(temp_path)
+            os.replace(temp_path, entry_path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        if evict:
+            self.evict()
+
+    def touch(self, entry_path: str) -> None:
+        """ Marks an entry as recently used """
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+    def remove(self, entry_paths: list) -> int:
+        """ Removes entries from the cache, returning the number removed """
+        removed = 0
+        for entry_path in entry_paths:
+            try:
+                os.remove(entry_path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def get_entries(self) -> list:
+        """ Returns a list of (last used time, size, path) for each entry, least recently used first """
+        entries = []
+        for entry_path in glob.glob(os.path.join(self.cache_dir, self.entry_pattern)):
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        return sorted(entries)
+
+    def get_size(self) -> int:
+        """ Returns the total size of the cache entries in bytes """
+        return sum(size for _, size, _ in self.get_entries())
+
+    def evict(self) -> None:
+        """ Removes the least recently used entries until the cache is no larger than `max_bytes` """
+        entries = self.get_entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if total <= self.max_bytes:
+                break
+            if self.remove([entry_path]) == 1:
+                total -= size
@@ -0,0 +1,141 @@
+"""
+An on-disk cache of reduced resolution copies of images, used for thumbnails and
+previews, as part of the Sediment Core Analysis project for CITS3200 at UWA.
+
+Date: October 2024
+"""
+import os
+import hashlib
+import cv2 as cv
+import numpy as np
+
+from app.utils.DiskCache import DiskCache
+
+class ImageCache(DiskCache):
+    """
+    A persistent cache of small copies of images, so thumbnails and previews are not
+    made by decoding the full resolution images every time they are opened.
+
+    Each entry is a JPEG named after the path, modification time and size of the image
+    and the size of the copy, so an image that has been changed on disk is read again.
+    Missing entries are made by decoding the image at 1/2, 1/4 or 1/8 of its resolution,
+    rather than decoding it in full and shrinking it. When the cache grows past
+    `max_bytes`, the least recently used entries are removed.
+
+    Attributes:
+        cache_dir (str): the directory the cache entries are stored in
+        max_bytes (int): the maximum total size of the cache entries in bytes
+    """
+    default_cache_dir = os.path.join(DiskCache.default_cache_dir, 'images')
+    entry_pattern = '*-*.jpg'
+    reduced_read_flags = [(8, cv.IMREAD_REDUCED_COLOR_8), (4, cv.IMREAD_REDUCED_COLOR_4), (2, cv.IMREAD_REDUCED_COLOR_2)]
+    jpeg_quality = 90
+    preview_size = 1280   # longest side of the previews shown in the image panel
+    thumbnail_size = 100  # longest side of the thumbnails in the thumbnail panel
+
+    def __init__(self, cache_dir: str=None, max_bytes: int=128 * 1024**2):
+        super().__init__(cache_dir, max_bytes)
+
+    def get_entry_path(self, image_path: str, max_side: int) -> str:
+        """ Returns the path of the cache entry for an image at a size, or raises OSError if the image does not exist """
+        stat = os.stat(image_path)
+        key = f'{os.path.abspath(image_path)}:{stat.st_mtime_ns}:{stat.st_size}'
+        return os.path.join(self.cache_dir, f'{hashlib.sha256(key.encode()).hexdigest()}-{max_side}.jpg')
+
+    def get_image(self, image_path: str, max_side: int):
+        """
+        Returns a BGR copy of an image whose longest side is at most `max_side` pixels,
+        from the cache if it is there, otherwise read from the image and cached.
+
+        Returns:
+            image (np.array): the reduced image, or None if the image could not be read
+        """
+        try:
+            entry_path = self.get_entry_path(image_path, max_side)
+        except OSError:
+            return None
+
+        image = cv.imread(entry_path, cv.IMREAD_COLOR) if os.path.exists(entry_path) else None
+        if image is not None:
+            self.touch(entry_path)
+            return image
+
+        image = read_reduced(image_path, max_side)
+        if image is not None:
+            self.put(entry_path, image)
+        return image
+
+    def fill(self, image_path: str, image: np.array) -> None:
+        """
+        Stores the preview and thumbnail of an image that has already been decoded (at full
+        resolution or as a preview), so they are not made by decoding it again. Cached sizes
+        are skipped, and the cache is evicted once after both are written.
+        """
+        try:
+            entry_paths = {max_side: self.get_entry_path(image_path, max_side) for max_side in [self.preview_size, self.thumbnail_size]}
+        except OSError:
+            return
+        missing = [max_side for max_side, entry_path in entry_paths.items() if not os.path.exists(entry_path)]
+        for max_side in missing:
+            image = shrink(image, max_side) # the thumbnail is shrunk from the preview
+            self.put(entry_paths[max_side], image, evict=False)
+        if len(missing) > 0:
+            self.evict()
+
+    def put(self, entry_path: str, image: np.array, evict: bool=True) -> None:
+        """ Stores a reduced image in the cache, then evicts the least recently used entries if the cache is too big """
+        self.write_entry(entry_path, lambda temp_path: write_jpeg(temp_path, image, self.jpeg_quality), evict)
+
+    def invalidate(self) -> int:
+        """
+        Removes every entry from the cache.
+
+        Returns:
+            removed (int): the number of entries removed
+        """
+        return self.remove([entry_path for _, _, entry_path in self.get_entries()])
+
+
+def read_reduced(image_path: str, max_side: int):
+    """
+    Function reading an image at the smallest of 1/8, 1/4, 1/2 or full resolution whose longest
+    side is at least `max_side`, then shrinking it so its longest side is at most `max_side`.
+
+    The image is first read at 1/8 resolution, which is cheap, and that is used to choose the
+    resolution to read it at.
+
+    Returns:
+        image (np.array): the reduced BGR image, or None if the image could not be read
+    """
+    image = cv.imread(image_path, cv.IMREAD_REDUCED_COLOR_8)
+    if image is None:
+        return None
+    full_side = 8 * max(image.shape[:2])
+    for factor, flag in ImageCache.reduced_read_flags:
+        if full_side // factor >= max_side:
+            if factor != 8:
+                image = cv.imread(image_path, flag)
+            break
+    else:
+        image = cv.imread(image_path, cv.IMREAD_COLOR)
+    if image is None:
+        return None
+    return shrink(image, max_side)
+
+def shrink(image: np.array, max_side: int) -> np.array:
+    """ Function shrinking an image so its longest side is at most `max_side`, keeping its aspect ratio """
+    long_side = max(image.shape[:2])
+    if long_side <= max_side:
+        return image
+    scale = max_side / long_side
+    size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+    return cv.resize(image, size, interpolation=cv.INTER_AREA)
+
+def write_jpeg(image_path: str, image: np.array, quality: int) -> None:
+    """ Function writing an image as a JPEG, raising OSError if it cannot be written """
+    try:
+        written = cv.imwrite(image_path, image, [cv.IMWRITE_JPEG_QUALITY, quality])
+    except cv.error as error:
+        raise OSError(f'Could not write {image_path}') from error
+    if not written:
+        raise OSError(f'Could not write {image_path}')
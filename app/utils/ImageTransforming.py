@@ -7,7 +7,6 @@ Date: September 2024
 """
 import cv2 as cv
 import numpy as np
-import matplotlib.pyplot as plt
 import pandas as pd
 
 """ Image importing and displaying functions """
@@ -19,6 +18,7 @@ def import_image(image_path: str) -> np.array:
 
 def show_image(image: np.array, title: str='Image') -> None:
     """ Displays an image"""
+    import matplotlib.pyplot as plt # imported here so that headless processing never loads a plotting backend
     plt.imshow(cv.cvtColor(image, cv.COLOR_BGR2RGB))
     plt.title(title)
     plt.show()
@@ -43,17 +43,57 @@ def remove_greys(image: np.array, show: bool=False) -> np.array:
         show_image(image_no_grey_white, title='Image with Greys and Whites Removed')
     return image_no_grey_white
 
-def get_contours(image: np.array, show: bool=False) -> list:
+def get_contours(image: np.array, show: bool=False, blur_size: int=101) -> list:
     """ Processes and finds contours in an image"""
     grey = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
-    blurred = cv.GaussianBlur(grey, (101, 101), 0)
-    _, binary = cv.threshold(blurred, 127, 255, cv.THRESH_OTSU)
+    _, binary = get_binary_mask(grey, blur_size=blur_size)
     contours, _ = cv.findContours(binary, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
     if show == True:
         cv.drawContours(image, contours, -1, (0, 255, 0), 3)
         show_image(image, title='Contours')
     return contours
 
+def get_binary_mask(grey: np.array, blur_size: int=101, threshold: float=None, sigma: float=0) -> tuple:
+    """
+    Blurs and thresholds a greyscale image into a binary mask of its foreground.
+
+    Parameters:
+        grey (np.array): a greyscale image
+        blur_size (int): the (odd) size of the Gaussian blur kernel
+        threshold (float): the threshold to apply. If `None`, Otsu's method chooses the threshold.
+        sigma (float): the standard deviation of the blur. If 0, it is calculated from `blur_size`.
+
+    Returns:
+        threshold (float): the threshold that was applied
+        binary (np.array): the binary mask
+    """
+    if grey.shape[0] > grey.shape[1]:
+        # OpenCV blurs tall, narrow images much more slowly than wide ones, the result is the same
+        blurred = cv.GaussianBlur(np.ascontiguousarray(grey.T), (blur_size, blur_size), sigma).T
+    else:
+        blurred = cv.GaussianBlur(grey, (blur_size, blur_size), sigma)
+    if threshold is None:
+        return cv.threshold(blurred, 127, 255, cv.THRESH_OTSU)
+    return cv.threshold(blurred, threshold, 255, cv.THRESH_BINARY)
+
+def downscale_image(image: np.array, pyramid_level: int) -> np.array:
+    """ Halves the size of an image `pyramid_level` times by area averaging"""
+    if pyramid_level == 0:
+        return image
+    factor = 2 ** pyramid_level
+    return cv.resize(image, None, fx=1/factor, fy=1/factor, interpolation=cv.INTER_AREA)
+
+def scale_kernel_size(kernel_size: int, factor: int) -> int:
+    """ Scales a blur kernel size down by a factor, keeping it odd and at least 3"""
+    scaled = int(round(kernel_size / factor))
+    if scaled % 2 == 0:
+        scaled += 1
+    return max(scaled, 3)
+
+def get_kernel_sigma(kernel_size: int) -> float:
+    """ Returns the standard deviation OpenCV uses for a Gaussian blur kernel of a given size"""
+    return 0.3 * ((kernel_size - 1) * 0.5 - 1) + 0.8
+
 def crop_image(image: np.array, bounding_box: list=None) -> np.array:
     """ Crops an image to a bounding box"""
     if bounding_box is None:
@@ -102,19 +142,43 @@ def core_to_rgb(df: pd.DataFrame) -> pd.DataFrame:
 
 def core_to_lab(df: pd.DataFrame) -> pd.DataFrame:
     """ Converts a DataFrame of a sediment core to CIE Lab """
-    image = reshape_df_to_image(df, colourspace='BGR')
-    image = scale_rgb_values(image)
-    image = cv.cvtColor(image, cv.COLOR_BGR2Lab)
-    image = reshape_image_to_df(image, colourspace='Lab')
+    image = reshape_image_to_df(bgr_to_lab(df[['Blue', 'Green', 'Red']].to_numpy()), colourspace='Lab')
     image['Depth (mm)'] = df['Depth (mm)']
     return image[['Depth (mm)', 'L', 'a', 'b']]
 
+def core_to_rgb_and_lab(df: pd.DataFrame) -> pd.DataFrame:
+    """ Returns a DataFrame of a sediment core with both its RGB and CIE Lab colours """
+    lab = bgr_to_lab(df[['Blue', 'Green', 'Red']].to_numpy())
+    # The rows of both are the same layers, so the Lab columns are added by position
+    lab_df = pd.DataFrame(lab, columns=['L', 'a', 'b'], index=df.index)
+    return pd.concat([df, lab_df], axis=1)
+
+def bgr_to_lab(bgr: np.array) -> np.array:
+    """ Converts an array of BGR colours (0 to 255) with shape (n, 3) to float32 CIE Lab colours """
+    return convert_bgr(bgr, cv.COLOR_BGR2Lab)
+
+def convert_bgr(bgr: np.array, conversion: int) -> np.array:
+    """
+    Converts an array of BGR colours (0 to 255) with shape (n, 3) to another colour space in a
+    single OpenCV call, returning float32 colours with shape (n, channels).
+
+    The colours are scaled to between 0 and 1 first, so e.g. `cv.COLOR_BGR2HSV` gives the hue
+    in degrees and `cv.COLOR_BGR2GRAY` gives the luminance between 0 and 1.
+    """
+    image = np.asarray(bgr).reshape((len(bgr), 1, 3)).astype(np.float32)
+    image = scale_rgb_values(image)
+    return cv.cvtColor(image, conversion).reshape((len(bgr), -1))
+
 
 """ Functions for flipping images """
 def swap_df_cols(data, new_col, old_col):
-    """ Swaps two columns in a dataframe"""
+    """ Swaps two columns in a dataframe, then orders the rows by the new values of `old_col` """
     data[new_col], data[old_col] = data[old_col], data[new_col]
-    data = data.sort_values(by=old_col)
+    if data[old_col].is_monotonic_decreasing:
+        # a flipped column is in reverse order, so reversing the rows sorts it without a sort
+        data = data.iloc[::-1]
+    elif not data[old_col].is_monotonic_increasing:
+        data = data.sort_values(by=old_col)
     data.reset_index(drop=True, inplace=True)
     return data
 
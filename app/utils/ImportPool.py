@@ -0,0 +1,136 @@
+"""
+A persistent pool of worker processes for importing sediment core images into the
+GUI, as part of the Sediment Core Analysis project for CITS3200 at UWA.
+
+Like the batch processing functions, this module must not import PyQt6 or a
+Qt matplotlib backend, since it is imported by every worker process.
+
+Date: October 2024
+"""
+import os
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from app.utils.ImageTransforming import orient_array
+from app.utils.ProcessSedimentCore import process_core_image
+from app.utils.ProfileCache import ProfileCache
+from app.utils.CoreProfile import CoreProfile
+from app.utils.ImageCache import ImageCache, shrink
+
+class ImportPool():
+    """
+    A pool of worker processes that stay alive between imports, so opening images
+    does not pay for starting Python and importing OpenCV, NumPy and pandas each time.
+
+    Each image is read, oriented and processed in a worker. The cropped core is sent
+    back through a shared memory block instead of being pickled through a pipe, and
+    `collect` copies it out and frees the block.
+
+    Attributes:
+        workers (int): the number of worker processes
+        core_width_mm (int): the width of the sediment cores in millimeters
+        pyramid_level (int): the pyramid level used to detect the cores
+        cache (ProfileCache): the cache of processed cores used by the workers
+        image_cache (ImageCache): the cache the previews and thumbnails of the imported images are stored in,
+            once the imports have been collected
+    """
+    def __init__(self, workers: int=None, core_width_mm: int=76, pyramid_level: int=2, cache: ProfileCache=None,
+                 image_cache: ImageCache=None):
+        self.workers = workers if workers is not None else get_default_workers()
+        self.core_width_mm = core_width_mm
+        self.pyramid_level = pyramid_level
+        self.cache = cache
+        self.image_cache = image_cache
+
+        # Workers share the parent's resource tracker, so the shared memory blocks they
+        # create are only tracked until the parent unlinks them
+        resource_tracker.ensure_running()
+        # Spawned rather than forked, since forking a process running Qt threads is unsafe
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker,
+                                            mp_context=multiprocessing.get_context('spawn'))
+
+    def warm_up(self) -> list:
+        """ Starts every worker process now, instead of when the first images are opened """
+        return [self.executor.submit(os.getpid) for _ in range(self.workers)]
+
+    def submit(self, image_path: str) -> Future:
+        """ Imports an image in a worker process. Pass the future to `collect` once it is done. """
+        return self.executor.submit(import_image_file, image_path, self.core_width_mm,
+                                    self.pyramid_level, self.cache)
+
+    @staticmethod
+    def collect(future: Future):
+        """
+        Returns the result of a finished import, freeing its shared memory. This must be
+        called for every import that ran, even if its result is no longer wanted.
+
+        Returns:
+            core (dict): a dictionary with the `'Profile'` (a CoreProfile of the RGB and CIELAB
+            colours) and `'Image'` of the core and the `'Preview'` of the whole image,
+            or 0 if no core was found in the image.
+        """
+        core = future.result()
+        if core == 0:
+            return 0
+        core["Image"] = from_shared_memory(core["Image"])
+        core["Preview"] = from_shared_memory(core["Preview"])
+        return core
+
+    def shutdown(self) -> None:
+        """ Stops the worker processes without waiting for queued imports """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def get_default_workers() -> int:
+    """ Returns the number of workers to use, leaving a core free for the GUI """
+    return max(1, min(4, (os.cpu_count() or 1) - 1))
+
+def warm_worker() -> None:
+    """ Runs a small conversion so OpenCV initialises its thread pool before the first import """
+    cv.cvtColor(np.zeros((8, 8, 3), dtype=np.uint8), cv.COLOR_BGR2LAB)
+
+def import_image_file(image_path: str, core_width_mm: int, pyramid_level: int, cache: ProfileCache=None):
+    """
+    Reads and processes an image in a worker process. The preview of the image is made
+    from the same decode, so the GUI does not decode the image again to show it.
+
+    Returns:
+        core (dict): the `'Profile'` of the core, and references to the cropped `'Image'` of
+        the core and the `'Preview'` of the image in shared memory, or 0 if no core was found.
+    """
+    image = cv.imread(image_path)
+    if image is None:
+        raise ValueError('The image could not be read')
+    image_hash = ProfileCache.hash_file(image_path) if cache is not None else None
+    core = process_core_image(orient_array(image), core_width_mm, df=False, pyramid_level=pyramid_level,
+                              cache=cache, image_hash=image_hash)
+    if core == 0:
+        return 0
+    return {
+        "Profile": CoreProfile.from_colours(core["Colours"], core["Scale"]),
+        "Image": to_shared_memory(core["Image"]),
+        "Preview": to_shared_memory(shrink(image, ImageCache.preview_size))
+    }
+
+def to_shared_memory(array: np.array) -> tuple:
+    """ Copies an array into a new shared memory block and returns (name, shape, dtype) """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    try:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    finally:
+        shm.close()
+    return shm.name, array.shape, array.dtype.str
+
+def from_shared_memory(reference: tuple) -> np.array:
+    """ Copies an array out of a shared memory block made by `to_shared_memory` and frees the block """
+    name, shape, dtype = reference
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return array
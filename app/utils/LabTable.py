@@ -0,0 +1,92 @@
+"""
+A lookup table of the CIELAB colour of every 8-bit BGR colour, used to average the
+colours of sediment cores in CIELAB, as part of the Sediment Core Analysis project
+for CITS3200 at UWA.
+
+Date: October 2024
+"""
+import os
+import threading
+import cv2 as cv
+import numpy as np
+
+from app.utils.ImageTransforming import convert_bgr
+
+loaded_tables = {} # table path -> memory-mapped table, shared by every LabTable in the process
+
+class LabTable():
+    """
+    The CIELAB colour of each of the 256³ BGR colours, so converting a pixel to CIELAB
+    is a table lookup rather than a floating point colour transform.
+
+    The table is built once, written to disk and memory-mapped, so every process that
+    uses it (such as the batch processing workers) shares one copy through the page cache
+    and only reads the parts of it for the colours it looks up. It holds hundredths of
+    a CIELAB unit as int16, which is 96 MB. It is named after the OpenCV version, since
+    that does the conversion the table is built with.
+
+    If the table cannot be built or read, each pixel is converted with OpenCV instead.
+
+    Attributes:
+        table_path (str): the path of the table file
+    """
+    default_table_dir = os.path.join(os.path.expanduser('~'), '.sediment_core_analysis')
+    scale = 100 # the table holds CIELAB values multiplied by this
+    colours_per_chunk = 256 * 256 # the colours converted at a time when building the table
+
+    def __init__(self, table_dir: str=None):
+        table_dir = table_dir if table_dir is not None else self.default_table_dir
+        self.table_path = os.path.join(table_dir, f'lab-table-opencv-{cv.__version__}.npy')
+
+    def get_table(self):
+        """ Returns the memory-mapped table, building it if no process has yet, or None if it cannot be built or read """
+        table = loaded_tables.get(self.table_path)
+        if table is not None:
+            return table
+        try:
+            if not os.path.exists(self.table_path):
+                self.build()
+            table = np.load(self.table_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if table.shape != (256**3, 3) or table.dtype != np.int16:
+            return None
+        loaded_tables[self.table_path] = table
+        return table
+
+    def build(self) -> None:
+        """
+        Writes the table to disk, a chunk of blue values at a time so it is never all in memory.
+        The table is written to a temporary file and then moved into place, so processes
+        building it at the same time never read a partial table.
+        """
+        temp_path = f'{self.table_path}.{os.getpid()}.{threading.get_ident()}.tmp.npy'
+        os.makedirs(os.path.dirname(self.table_path), exist_ok=True)
+        try:
+            table = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.int16, shape=(256**3, 3))
+            green, red = np.divmod(np.arange(self.colours_per_chunk), 256)
+            for blue in range(256):
+                bgr = np.stack([np.full(self.colours_per_chunk, blue), green, red], axis=1)
+                start = blue * self.colours_per_chunk
+                table[start:start + self.colours_per_chunk] = np.rint(convert_bgr(bgr, cv.COLOR_BGR2Lab) * self.scale)
+            table.flush()
+            del table
+            os.replace(temp_path, self.table_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def convert(self, bgr: np.array) -> np.array:
+        """ Returns the CIELAB colours (as float32) of an array of uint8 BGR pixels of any shape `(..., 3)` """
+        table = self.get_table()
+        if table is None:
+            bgr = np.asarray(bgr)
+            return convert_bgr(bgr.reshape(-1, 3), cv.COLOR_BGR2Lab).reshape(bgr.shape)
+        # take is several times faster than indexing the table with the keys
+        return np.take(table, pack_bgr(bgr), axis=0) * np.float32(1 / self.scale)
+
+
+def pack_bgr(bgr: np.array) -> np.array:
+    """ Function returning the index of each uint8 BGR pixel in the table, `blue * 256² + green * 256 + red` """
+    bgr = np.asarray(bgr, dtype=np.uint8)
+    return (bgr[..., 0].astype(np.uint32) << 16) | (bgr[..., 1].astype(np.uint32) << 8) | bgr[..., 2]
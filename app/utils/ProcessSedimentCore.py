@@ -9,8 +9,14 @@ import os
 import cv2 as cv
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 import app.utils.ImageTransforming as transform
+from app.utils.ProfileCache import ProfileCache
+from app.utils.LabTable import LabTable
+
+ALGORITHM_VERSION = 2 # increase when a change to the processing changes its results, to invalidate cached profiles
 
 class Scaling():
     """ 
@@ -52,31 +58,123 @@ class ExtractCore():
         core_width_mm (int): the width of the sediment core in millimeters
         image (numpy.ndarray): the image as an array
         core (dict): the extracted sediment core
+        pyramid_level (int): the number of times the image is halved in size before searching for cores
+            (0 searches the full resolution image)
+        tolerance_px (int): the largest difference (in pixels) between an edge found at a coarse 
+            pyramid level and the same edge at full resolution that is refined rather than redetected
     """
-    def __init__(self, image: np.array, core_width_mm: int):
+    min_core_area = 100000 # the sediment cores are big! (in pixels at full resolution)
+    blur_size = 101 # the size of the blur kernel at full resolution
+
+    def __init__(self, image: np.array, core_width_mm: int, pyramid_level: int=0, tolerance_px: int=4):
         self.core_width_mm = core_width_mm
         self.image = image
+        self.pyramid_level = pyramid_level
+        self.tolerance_px = tolerance_px
+        self.grey = None
+        self.threshold = None
 
     def find_cores(self) -> list:
         """
         Finds the sediment cores in an image. This function is
         specific to the images in the Sediment Core Analysis project.
 
+        If `pyramid_level` is greater than 0, the image is downscaled before it is colour 
+        segmented, blurred and thresholded, with the area and blur thresholds scaled to 
+        match, and the bounding boxes are returned in full resolution coordinates. Only the
+        strips around the edges of the core are segmented at full resolution, when they are refined.
+
         Returns:
             cores (list): a list of the sediment cores in the image
         """
-        no_greys = transform.remove_greys(self.image) # colour segmentation
-        contours = transform.get_contours(no_greys)
+        if self.pyramid_level == 0:
+            self.grey = segment_colours(self.image)
+            return self.find_contours(self.grey, 1)
+        return self.find_contours(segment_colours(transform.downscale_image(self.image, self.pyramid_level)),
+                                  2 ** self.pyramid_level)
+
+    def find_contours(self, grey: np.array, factor: int) -> list:
+        """
+        Returns the bounding boxes (in full resolution coordinates) of the sediment cores in a colour
+        segmented image that is `factor` times smaller than the full resolution image
+        """
+        blur_size = transform.scale_kernel_size(self.blur_size, factor)
+        sigma = transform.get_kernel_sigma(self.blur_size) / factor
+        self.threshold, binary = transform.get_binary_mask(grey, blur_size=blur_size, sigma=sigma)
+        contours, _ = cv.findContours(binary, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
 
         # find contours that correspond to sediment cores
         cores = []
         for contour in contours:
             area = cv.contourArea(contour)
-            if area > 100000: # the sediment cores are big!
+            if area > self.min_core_area / factor**2: # the sediment cores are big!
                 x, y, w, h = cv.boundingRect(contour)
                 if w > h*2 or h > w*2: # the sediment cores are long and thin
-                    cores.append([x, y, w, h])
+                    cores.append([x * factor, y * factor, w * factor, h * factor])
         return cores    
+
+    def refine_bounding_box(self, bounding_box: list) -> list:
+        """
+        Refines a bounding box found at a coarse pyramid level by repeating the detection 
+        at full resolution in narrow strips around each of its four edges.
+
+        If an edge is not found strictly inside its strip, the coarse estimate was too far
+        off and the bounding box is found again on the full resolution image.
+        """
+        factor = 2 ** self.pyramid_level
+        margin = max(self.tolerance_px, 2 * factor)
+        x, y, w, h = bounding_box
+        left, top, right, bottom = x, y, x + w - 1, y + h - 1
+        rows = (top - margin, bottom + margin + 1)
+        cols = (left - margin, right + margin + 1)
+
+        edges = [
+            self.find_edge(rows, (left - margin, left + margin + 1), axis=1, first=True),
+            self.find_edge((top - margin, top + margin + 1), cols, axis=0, first=True),
+            self.find_edge(rows, (right - margin, right + margin + 1), axis=1, first=False),
+            self.find_edge((bottom - margin, bottom + margin + 1), cols, axis=0, first=False)
+        ]
+        if None in edges: # the cores are found again in the whole image at full resolution
+            self.grey = segment_colours(self.image)
+            cores = self.find_contours(self.grey, 1)
+            return self.get_largest_core(cores) if len(cores) > 0 else 0
+        left, top, right, bottom = edges
+        return [left, top, right - left + 1, bottom - top + 1]
+
+    def find_edge(self, rows: tuple, cols: tuple, axis: int, first: bool) -> int:
+        """
+        Returns the full resolution coordinate of the first (or last) foreground column (`axis=1`) 
+        or row (`axis=0`) inside a window of the image, or `None` if it is not strictly inside the window.
+
+        The window is padded by half the blur kernel so that the blur sees the same 
+        neighbourhood as it does when the whole image is processed.
+        """
+        image_h, image_w = self.image.shape[:2]
+        pad = self.blur_size // 2
+        r0, r1 = max(rows[0], 0), min(rows[1], image_h)
+        c0, c1 = max(cols[0], 0), min(cols[1], image_w)
+        pr0, pc0 = max(r0 - pad, 0), max(c0 - pad, 0)
+        window = (slice(pr0, min(r1 + pad, image_h)), slice(pc0, min(c1 + pad, image_w)))
+        # the colour segmentation is per pixel, so segmenting the window matches segmenting the whole image
+        window = self.grey[window] if self.grey is not None else segment_colours(self.image[window])
+        _, binary = transform.get_binary_mask(window, blur_size=self.blur_size, threshold=self.threshold)
+        binary = binary[r0 - pr0:r1 - pr0, c0 - pc0:c1 - pc0]
+
+        # only keep the foreground that joins the inside of the bounding box, not other objects
+        _, labels = cv.connectedComponents(binary)
+        inner_border = labels[:, -1 if first else 0] if axis == 1 else labels[-1 if first else 0, :]
+        inner_labels = np.setdiff1d(inner_border, [0])
+        core_mask = np.isin(labels, inner_labels)
+
+        foreground = np.flatnonzero(core_mask.any(axis=1 - axis))
+        if len(foreground) == 0:
+            return None
+        start, stop, limit = (c0, c1, image_w) if axis == 1 else (r0, r1, image_h)
+        edge = foreground[0] if first else foreground[-1]
+        # an edge on the border of the window may carry on outside of it (unless it is the image border)
+        if (edge == 0 and start > 0) or (edge == stop - start - 1 and stop < limit):
+            return None
+        return int(start + edge)
     
     def get_largest_core(self, cores: list) -> list:
         """
@@ -101,6 +199,8 @@ class ExtractCore():
             bounding_box = bounding_boxes[0]
         else:
             bounding_box = self.get_largest_core(bounding_boxes)
+        if self.pyramid_level > 0:
+            bounding_box = self.refine_bounding_box(bounding_box)
         return bounding_box
 
     def extract_core(self, from_bounding_box=False, bounding_box=None) -> dict:
@@ -125,6 +225,10 @@ class ExtractCore():
         }
         return self.core
 
+def segment_colours(image: np.array) -> np.array:
+    """ Function returning a greyscale image of the parts of a BGR image that are not grey or white """
+    return cv.cvtColor(transform.remove_greys(image), cv.COLOR_BGR2GRAY)
+
 class Colours():
     """
     A class for determining the colour of each layer in a sediment core.
@@ -135,12 +239,17 @@ class Colours():
         width (int): the width of the sediment core in pixels
         colour (int): the number of colour channels in the image
         weights (numpy.ndarray): the weights for the weighted average of the colour channels
+        workers (int): the number of processes used to reduce very tall cores
     """
-    def __init__(self, image: np.array, scale: float):
+    parallel_min_rows = 100000 # cores shorter than this are always reduced in a single process
+    rows_per_band = 20000 # the smallest band of rows handed to a worker process
+
+    def __init__(self, image: np.array, scale: float, workers: int=1):
         self.image = transform.orient_array(image)
         self.height, self.width, self.colour = self.image.shape
         self.weights = None
         self.scale = scale
+        self.workers = workers
     
     def get_weights(self):
         """ Returns the weights for the weighted average of the colour channels """
@@ -158,40 +267,143 @@ class Colours():
         """ Returns the rounded weighted average for a colour channel"""
         return np.round(np.average(colour_values, weights=self.weights), 0)
     
-    def get_weighted_average_layer_colours(self, df: bool=True) -> np.array:
+    def get_weighted_average_layer_colours(self, df: bool=True, dtype: type=np.float64) -> np.array:
         """
         Returns the weighted average colours of each layer of a sediment core.
+
+        Every layer is reduced in a single tensor operation, with the weights
+        broadcast across the rows and colour channels of the image. If `workers` 
+        is greater than 1 and the core has at least `parallel_min_rows` rows, the 
+        core is split into bands of rows that are reduced in a process pool.
         
         Parameters:
             df (bool): whether to return the colours as a pandas DataFrame
+            dtype (type): the floating point type used to accumulate the weighted sums
+                (`np.float64` matches `np.average` exactly, `np.float32` halves the memory used)
             
         Returns:
-            weighted_avgs (list): a list of the weighted average colours of each layer.
+            weighted_avgs (np.ndarray): an array of the weighted average colours of each layer.
             If `df` is set to `True`, the function returns a pandas DataFrame.
         """
         self.get_weights()
-        weighted_avgs = []
-        for y in range(0, self.height):
-            row = self.image[y, :]
-            channel_avgs = []
-            for c in range(0, self.colour):
-                colour_values = row[:, c]
-                weighted_avg = self.get_weighted_avg_colour_channel(colour_values)
-                channel_avgs.append(weighted_avg)
-            weighted_avgs.append(channel_avgs)
+        if self.workers > 1 and self.height >= self.parallel_min_rows:
+            weighted_avgs = parallel_weighted_average_rows(self.image, self.weights, dtype, 
+                                                           self.workers, self.rows_per_band)
+        else:
+            weighted_avgs = weighted_average_rows(self.image, self.weights, dtype)
         
-        scaled_depths = [y * self.scale for y in range(0, self.height)]
+        scaled_depths = np.arange(0, self.height) * self.scale
         if df == True:
             df = pd.DataFrame(weighted_avgs, columns=['Blue', 'Green', 'Red'])
             df['Depth (mm)'] = scaled_depths
             df = df[['Depth (mm)', 'Blue', 'Green', 'Red']]
             return df
-        return np.array(weighted_avgs)
+        return weighted_avgs
+
+    def get_weighted_average_layer_lab(self, lab_table: LabTable=None) -> np.array:
+        """
+        Returns the weighted average CIELAB colours of each layer of a sediment core, 
+        averaging the CIELAB colours of the pixels rather than converting the average 
+        BGR colour of each layer (as `ImageTransforming.core_to_lab` does).
+
+        The pixels are converted through a `LabTable`, a band of rows at a time.
+
+        Parameters:
+            lab_table (LabTable): the table to convert the pixels with (the default table if `None`)
 
+        Returns:
+            weighted_avgs (np.ndarray): an array of shape (height, 3) of the L, a and b of each layer
+        """
+        self.get_weights()
+        lab_table = lab_table if lab_table is not None else LabTable()
+        return weighted_average_lab_rows(self.image, self.weights, lab_table, self.rows_per_band)
+
+
+def weighted_average_rows(image: np.array, weights: np.array, dtype: type=np.float64) -> np.array:
+    """
+    Returns the rounded weighted average of every row of an image for each colour channel.
+
+    Parameters:
+        image (numpy.ndarray): an image of shape (height, width, colour)
+        weights (numpy.ndarray): the weight of each column of the image
+        dtype (type): the floating point type used to accumulate the weighted sums
+
+    Returns:
+        weighted_avgs (numpy.ndarray): an array of shape (height, colour)
+    """
+    weights = np.asarray(weights, dtype=dtype)
+    total_weight = weights.sum()
+    if total_weight == 0:
+        raise ZeroDivisionError("Weights sum to zero, can't be normalized")
+    weighted_sums = np.tensordot(image, weights, axes=([1], [0]))
+    return np.round(weighted_sums / total_weight, 0)
+
+def weighted_average_lab_rows(image: np.array, weights: np.array, lab_table: LabTable,
+                              rows_per_band: int=20000) -> np.array:
+    """
+    Returns the weighted average CIELAB colour of every row of a BGR image, converting
+    `rows_per_band` rows of pixels to CIELAB at a time so the image is never all converted at once.
+
+    Returns:
+        weighted_avgs (numpy.ndarray): an array of shape (height, 3)
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    total_weight = weights.sum()
+    if total_weight == 0:
+        raise ZeroDivisionError("Weights sum to zero, can't be normalized")
+    rows_per_band = max(1, min(rows_per_band, (1 << 20) // max(image.shape[1], 1)))
+    weighted_avgs = np.empty((image.shape[0], 3))
+    for start in range(0, image.shape[0], rows_per_band):
+        lab = lab_table.convert(image[start:start + rows_per_band])
+        weighted_avgs[start:start + rows_per_band] = np.tensordot(lab, weights, axes=([1], [0])) / total_weight
+    return weighted_avgs
+
+def parallel_weighted_average_rows(image: np.array, weights: np.array, dtype: type=np.float64,
+                                   workers: int=2, rows_per_band: int=20000) -> np.array:
+    """
+    Returns the same result as `weighted_average_rows`, but splits the image into bands 
+    of rows that are reduced in a pool of `workers` processes.
+
+    The image is copied once into shared memory, so each worker reads its band 
+    directly instead of receiving a pickled copy. The partial results are stitched 
+    back together in depth order.
+    """
+    height = image.shape[0]
+    num_bands = max(1, min(workers, height // max(rows_per_band, 1)))
+    band_edges = np.linspace(0, height, num_bands + 1).astype(int)
+
+    shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+    try:
+        shared_image = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+        shared_image[:] = image
+        with ProcessPoolExecutor(max_workers=min(workers, num_bands)) as pool:
+            futures = [pool.submit(_reduce_shared_band, shm.name, image.shape, image.dtype.str,
+                                   weights, dtype, start, stop)
+                       for start, stop in zip(band_edges[:-1], band_edges[1:])]
+            partial_avgs = [future.result() for future in futures]
+        del shared_image
+    finally:
+        shm.close()
+        shm.unlink()
+    return np.concatenate(partial_avgs)
+
+def _reduce_shared_band(shm_name: str, shape: tuple, image_dtype: str, weights: np.array,
+                        dtype: type, start: int, stop: int) -> np.array:
+    """ Reduces rows `start` to `stop` of an image held in shared memory (runs in a worker process) """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image = np.ndarray(shape, dtype=image_dtype, buffer=shm.buf)
+        band_avgs = weighted_average_rows(image[start:stop], weights, dtype)
+        del image
+    finally:
+        shm.close()
+    return band_avgs
 
 def process_core_image(image: np.array, core_width_mm: int, 
                        from_bounding_box: bool=False, bounding_box: list=None,
-                       df: bool=True) -> dict:
+                       df: bool=True, workers: int=1, pyramid_level: int=0,
+                       cache: ProfileCache=None, image_hash: str=None, progress=None,
+                       pixel_lab: bool=False) -> dict:
     """ 
     Function for processing a sediment core image.
 
@@ -204,6 +416,9 @@ def process_core_image(image: np.array, core_width_mm: int,
     4. Rotates the sediment core so that it is vertical.
     5. Determines the colour of each layer in the sediment core.
 
+    If a `cache` is given, the bounding box, length, scale and colours are looked up 
+    in it first, and stored in it after the image is processed.
+
     If a sediment core is not found, the function returns 0.
     Otherwise, returns a pandas `DataFrame` with the following:
     - `'Image'`: the cropped colour image of the sediment core
@@ -212,33 +427,77 @@ def process_core_image(image: np.array, core_width_mm: int,
     (as a pandas `DataFrame` if the parameter `df` is set to `True`)
     - `'Scale'`: the number of pixels per millimeter
     - `'Bounding Box'`: the bounding box (`[x, y, width, height]`) of the sediment core in the image
+    - `'Lab'`: the weighted average CIELAB colours of the pixels of each layer (only if `pixel_lab` is `True`)
 
     Parameters:
         image (numpy.ndarray): the image of the sediment core
         core_width_mm (int): the width of the sediment core in millimeters
         from_bounding_box (bool): whether to extract the sediment core from a bounding box
         bounding_box (list): the bounding box of the sediment core (if `from_bounding_box` is `True`)
+        workers (int): the number of processes used to determine the colours of very tall cores
+        pyramid_level (int): the number of times the image is halved in size to search for the core
+            (the bounding box is then refined at full resolution)
+        cache (ProfileCache): a cache of processed cores to look the image up in
+        image_hash (str): the content hash of the image file (if `None`, the image array is hashed)
+        progress (callable): called with the name of each step (`'Detecting core'`, 
+            `'Measuring layer colours'`) before it starts. It may raise an exception to stop processing.
+        pixel_lab (bool): whether to also average the CIELAB colours of the pixels of each layer
 
     Returns:
         core (pd.DataFrame): a `DataFrame` containing the image, length, colours, 
             scale, and bounding box of the sediment core.
     """
-    extract_core = ExtractCore(image, core_width_mm)
+    if cache is not None:
+        image_hash = image_hash if image_hash is not None else ProfileCache.hash_image(image)
+        parameters = get_processing_parameters(core_width_mm, from_bounding_box, bounding_box, df, pyramid_level, pixel_lab)
+        parameter_hash = ProfileCache.hash_parameters(parameters)
+        core = cache.get(image_hash, parameter_hash)
+        if core is not None:
+            if core == 0: return 0
+            core["Image"] = transform.orient_array(transform.crop_image(image, core["Bounding Box"]))
+            return core
+
+    if progress is not None: progress('Detecting core')
+    extract_core = ExtractCore(image, core_width_mm, pyramid_level=pyramid_level)
 
     core_data = extract_core.extract_core(from_bounding_box=from_bounding_box, bounding_box=bounding_box)
-    if core_data == 0: return 0
+    if core_data == 0:
+        if cache is not None:
+            cache.put(image_hash, parameter_hash, 0)
+        return 0
     image = core_data['Image']
     scale = core_data['Scale']
-    colours = Colours(image, scale).get_weighted_average_layer_colours(df=df)
+    if progress is not None: progress('Measuring layer colours')
+    colours = Colours(image, scale, workers=workers)
     core = {
         "Image": image,
         "Length (mm)": core_data['Length'],
-        "Colours": colours,
+        "Colours": colours.get_weighted_average_layer_colours(df=df),
         "Scale": scale,
         "Bounding Box": core_data['Bounding Box']
     }
+    if pixel_lab:
+        core["Lab"] = colours.get_weighted_average_layer_lab()
+    if cache is not None:
+        cache.put(image_hash, parameter_hash, core)
     return core
 
+def get_processing_parameters(core_width_mm: int, from_bounding_box: bool=False, bounding_box: list=None,
+                              df: bool=True, pyramid_level: int=0, pixel_lab: bool=False) -> dict:
+    """ Returns the parameters that the result of `process_core_image` depends on, for cache keys """
+    parameters = {
+        "Algorithm Version": ALGORITHM_VERSION,
+        "Core Width (mm)": core_width_mm,
+        "Bounding Box": list(bounding_box) if from_bounding_box and bounding_box is not None else None,
+        "DataFrame": bool(df),
+        "Pyramid Level": pyramid_level,
+        "Minimum Core Area": ExtractCore.min_core_area,
+        "Blur Size": ExtractCore.blur_size
+    }
+    if pixel_lab: # only added when set, so the keys of existing cache entries are unchanged
+        parameters["Pixel Lab"] = True
+    return parameters
+
 def show_bounding_box(image, bounding_box):
     """ Draws a bounding box around a sediment core in an image """
     x, y, w, h = bounding_box
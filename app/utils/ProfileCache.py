@@ -0,0 +1,119 @@
+"""
+An on-disk cache of processed sediment cores as part of the Sediment Core
+Analysis project for CITS3200 at UWA.
+
+Date: October 2024
+"""
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+from app.utils.DiskCache import DiskCache
+
+class ProfileCache(DiskCache):
+    """
+    A persistent cache of the bounding box, scale, length and colour profile of
+    processed sediment core images.
+
+    Each entry is stored as a `.npz` file named after the content hash of the image
+    and the hash of the parameters it was processed with, so changing the core width,
+    a detection threshold or the algorithm version never returns a stale profile.
+    When the cache grows past `max_bytes`, the least recently used entries are removed.
+
+    Attributes:
+        cache_dir (str): the directory the cache entries are stored in
+        max_bytes (int): the maximum total size of the cache entries in bytes
+    """
+    default_cache_dir = os.path.join(DiskCache.default_cache_dir, 'profiles')
+    entry_pattern = '*.npz'
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        """ Returns the SHA-256 hash of the contents of a file """
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def hash_image(image: np.array) -> str:
+        """ Returns the SHA-256 hash of the shape, type and pixels of an image """
+        sha = hashlib.sha256(f'{image.shape}{image.dtype}'.encode())
+        sha.update(np.ascontiguousarray(image).data)
+        return sha.hexdigest()
+
+    @staticmethod
+    def hash_parameters(parameters: dict) -> str:
+        """ Returns a short hash of the parameters used to process an image """
+        encoded = json.dumps(parameters, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+    def get_entry_path(self, image_hash: str, parameter_hash: str) -> str:
+        """ Returns the path of the cache entry for an image and set of parameters """
+        return os.path.join(self.cache_dir, f'{image_hash}-{parameter_hash}.npz')
+
+    def get(self, image_hash: str, parameter_hash: str):
+        """
+        Returns the cached core for an image and set of parameters.
+
+        Returns:
+            core (dict): a dictionary with the `'Length (mm)'`, `'Colours'`, `'Scale'` and
+            `'Bounding Box'` (and `'Lab'` if it was stored) of the core, 0 if no core was found in the image, or `None`
+            if the image is not in the cache.
+        """
+        entry_path = self.get_entry_path(image_hash, parameter_hash)
+        try:
+            with np.load(entry_path, allow_pickle=False) as entry:
+                bounding_box = entry['bounding_box'].tolist()
+                if len(bounding_box) == 0:
+                    core = 0
+                else:
+                    columns = entry['columns'].tolist()
+                    colours = entry['colours']
+                    core = {
+                        "Length (mm)": float(entry['length']),
+                        "Colours": pd.DataFrame(colours, columns=columns) if columns else colours,
+                        "Scale": float(entry['scale']),
+                        "Bounding Box": bounding_box
+                    }
+                    if 'lab' in entry.files:
+                        core["Lab"] = entry['lab']
+        except (OSError, KeyError, ValueError):
+            return None
+        self.touch(entry_path)
+        return core
+
+    def put(self, image_hash: str, parameter_hash: str, core) -> None:
+        """
+        Stores a processed core (or 0 if no core was found) in the cache, then
+        evicts the least recently used entries if the cache is too big.
+        """
+        if core == 0:
+            arrays = {'bounding_box': np.array([], dtype=int)}
+        else:
+            colours = core['Colours']
+            is_df = isinstance(colours, pd.DataFrame)
+            arrays = {
+                'bounding_box': np.array(core['Bounding Box'], dtype=int),
+                'length': np.array(core['Length (mm)']),
+                'scale': np.array(core['Scale']),
+                'colours': colours.to_numpy() if is_df else np.asarray(colours),
+                'columns': np.array(list(colours.columns) if is_df else [], dtype=str)
+            }
+            if 'Lab' in core:
+                arrays['lab'] = np.asarray(core['Lab'])
+        self.write_entry(self.get_entry_path(image_hash, parameter_hash), lambda temp_path: np.savez(temp_path, **arrays))
+
+    def invalidate(self, image_hash: str=None, parameter_hash: str=None) -> int:
+        """
+        Removes entries from the cache. If neither hash is given, the whole cache is cleared.
+
+        Returns:
+            removed (int): the number of entries removed
+        """
+        pattern = f'{image_hash or "*"}-{parameter_hash or "*"}.npz'
+        return self.remove(glob.glob(os.path.join(self.cache_dir, pattern)))
@@ -0,0 +1,236 @@
+"""
+A long running ingest mode that processes sediment core images as they are
+scanned into a folder, as part of the Sediment Core Analysis project for CITS3200 at UWA.
+
+Like the batch processing functions, this module must not import PyQt6 or a
+Qt matplotlib backend.
+
+Date: October 2024
+"""
+import os
+import json
+import time
+import signal
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import app.utils.BatchProcessing as batch
+from app.utils.CoreProfile import CoreProfile
+
+class WatchFolder():
+    """
+    Watches a directory for new or modified sediment core images and processes each one
+    in a bounded pool of worker processes, writing its profile as soon as it is finished.
+
+    The directory is polled, and a file is only queued once its size and modification time
+    have stopped changing for `settle_seconds`, so partially written scans are not read.
+    Results are recorded in the same manifest as batch runs, so restarting the watcher
+    does not reprocess images that are already up to date. The throughput, queue depth
+    and latency of the watcher are written to a JSON status file after every poll.
+
+    Attributes:
+        watch_dir (str): the directory to watch for images
+        output_dir (str): the directory to write the profiles, manifest and status file to
+        core_width_mm (int): the width of the sediment cores in millimeters
+        workers (int): the maximum number of images processed at the same time
+        poll_interval (float): the number of seconds between polls of the directory
+        settle_seconds (float): how long a file must be unchanged before it is processed
+        status_path (str): the path of the status file
+        colour_spaces (tuple): the colour spaces written to the profiles
+        pixel_lab (bool): whether to average the CIELAB colours of the pixels of each layer
+    """
+    def __init__(self, watch_dir: str, output_dir: str, core_width_mm: int=76, workers: int=2,
+                 poll_interval: float=2., settle_seconds: float=5., pyramid_level: int=2,
+                 status_path: str=None, colour_spaces: tuple=CoreProfile.default_colour_spaces, pixel_lab: bool=False):
+        self.watch_dir = watch_dir
+        self.output_dir = output_dir
+        self.core_width_mm = core_width_mm
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.pyramid_level = pyramid_level
+        self.colour_spaces = colour_spaces
+        self.pixel_lab = pixel_lab
+        self.status_path = status_path if status_path is not None else os.path.join(output_dir, 'status.json')
+        self.parameters = batch.get_batch_parameters(core_width_mm, pyramid_level, colour_spaces, pixel_lab)
+        self.parameter_hash = batch.get_parameter_hash(core_width_mm, pyramid_level, colour_spaces, pixel_lab)
+
+        self.pool = None
+        self.manifest = {}
+        self.changing = {} # image path -> ((size, modified time), time the file was last seen changing)
+        self.queue = deque() # (image path, signature, input hash, time queued)
+        self.in_progress = {} # future -> (image path, signature, input hash, time queued)
+        self.writing = {} # image path -> name of the profile being written
+        self.finished = {} # image path -> signature of the file when it was processed
+        self.unsaved = False # whether the manifest has results that have not been written yet
+        self.stopped = False
+
+        self.started = time.time()
+        self.counts = {"Processed": 0, "No Core": 0, "Failed": 0, "Skipped": 0}
+        self.latencies = deque(maxlen=100)
+        self.last_error = None
+
+    def run(self, duration: float=None) -> None:
+        """ Polls the directory until `stop` is called, or for `duration` seconds """
+        end = None if duration is None else time.monotonic() + duration
+        try:
+            while not self.stopped and (end is None or time.monotonic() < end):
+                try:
+                    self.poll()
+                except OSError as error: # e.g. the output directory is briefly unavailable, so try again next poll
+                    self.record_error(error)
+                time.sleep(self.poll_interval)
+        finally:
+            self.shutdown()
+
+    def stop(self) -> None:
+        """ Stops the watcher after its current poll """
+        self.stopped = True
+
+    def poll(self) -> None:
+        """ Collects finished images, queues newly settled files, starts queued images and writes the status """
+        if self.pool is None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self.manifest = batch.load_manifest(self.output_dir)
+            self.pool = self.create_pool()
+        self.collect()
+        self.scan()
+        self.submit()
+        self.write_status()
+
+    def scan(self) -> None:
+        """ Queues the images whose size and modification time have settled """
+        now = time.monotonic()
+        for image_path in batch.find_images([self.watch_dir]):
+            try:
+                stat = os.stat(image_path)
+            except OSError: # the file was removed while scanning
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.finished.get(image_path) == signature or stat.st_size == 0:
+                continue
+            last_change = self.changing.get(image_path)
+            if last_change is None or last_change[0] != signature:
+                self.changing[image_path] = (signature, now)
+            elif now - last_change[1] >= self.settle_seconds:
+                del self.changing[image_path]
+                self.enqueue(image_path, signature, now)
+
+    def enqueue(self, image_path: str, signature: tuple, now: float) -> None:
+        """ Queues a settled image, unless the manifest shows it is already up to date """
+        self.finished[image_path] = signature
+        try:
+            input_hash = batch.get_input_hash(image_path, self.manifest.get(image_path))
+        except OSError:
+            return
+        if batch.is_up_to_date(self.manifest.get(image_path), input_hash, self.parameter_hash):
+            self.counts["Skipped"] += 1
+            return
+        self.queue.append((image_path, signature, input_hash, now))
+
+    def submit(self) -> None:
+        """ Starts queued images while fewer than `workers` images are being processed """
+        while self.queue and len(self.in_progress) < self.workers:
+            job = self.queue.popleft()
+            # the profiles being written are not in the manifest yet, so their names are reserved
+            reserved_names = {name for image_path, name in self.writing.items() if image_path != job[0]}
+            self.writing[job[0]] = batch.get_output_names([job[0]], self.manifest, reserved_names)[job[0]]
+            future = self.pool.submit(batch.process_image_file, job[0], os.path.join(self.output_dir, self.writing[job[0]]),
+                                      self.core_width_mm, self.pyramid_level, self.colour_spaces, self.pixel_lab)
+            self.in_progress[future] = job
+
+    def collect(self) -> None:
+        """ Records the results of finished images in the manifest and statistics """
+        broken = False
+        finished = [future for future in self.in_progress if future.done()]
+        for future in finished:
+            image_path, _, input_hash, queued = self.in_progress.pop(future)
+            if not any(job[0] == image_path for job in self.in_progress.values()):
+                self.writing.pop(image_path, None)
+            try:
+                result = future.result()
+            except Exception as error: # a worker process died, e.g. it ran out of memory
+                broken = broken or isinstance(error, BrokenProcessPool)
+                result = {"Image": image_path, "Status": f"failed: {error!r}", "Profile": None, "Seconds": None}
+
+            if result["Status"] == "processed":
+                self.counts["Processed"] += 1
+            elif result["Status"] == "no core detected":
+                self.counts["No Core"] += 1
+            else:
+                self.counts["Failed"] += 1
+                self.last_error = {"Image": image_path, "Status": result["Status"], "Time": datetime.now().isoformat()}
+            self.latencies.append(time.monotonic() - queued)
+            self.manifest[image_path] = dict(input_hash, **{"Parameter Hash": self.parameter_hash,
+                                                            "Parameters": self.parameters, "Summary": result})
+            self.unsaved = True
+
+        if broken: # replace the pool so the images still in the queue can be processed
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = self.create_pool()
+        if self.unsaved: # a manifest that could not be written is written again after the next poll
+            try:
+                batch.save_manifest(self.output_dir, self.manifest)
+                self.unsaved = False
+            except OSError as error:
+                self.record_error(error)
+
+    def create_pool(self) -> ProcessPoolExecutor:
+        """ Returns a pool of worker processes that leave Ctrl+C to the watcher """
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=ignore_interrupts)
+
+    def get_status(self) -> dict:
+        """ Returns the throughput, queue depth and latency of the watcher """
+        uptime = time.time() - self.started
+        completed = self.counts["Processed"] + self.counts["No Core"] + self.counts["Failed"]
+        latencies = list(self.latencies)
+        return {
+            "Watching": os.path.abspath(self.watch_dir),
+            "Started": datetime.fromtimestamp(self.started).isoformat(),
+            "Updated": datetime.now().isoformat(),
+            "Uptime (s)": round(uptime, 1),
+            "Queue Depth": len(self.queue),
+            "In Progress": len(self.in_progress),
+            "Settling": len(self.changing),
+            **self.counts,
+            "Throughput (images/min)": round(60 * completed / uptime, 2) if uptime > 0 else 0.,
+            "Latency (s)": {
+                "Last": round(latencies[-1], 3) if latencies else None,
+                "Mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "Max": round(max(latencies), 3) if latencies else None
+            },
+            "Last Error": self.last_error
+        }
+
+    def write_status(self) -> None:
+        """ Writes the status of the watcher to the status file, leaving the last status in place if it cannot be written """
+        temp_path = f'{self.status_path}.tmp'
+        try:
+            with open(temp_path, 'w') as file:
+                json.dump(self.get_status(), file, indent=1)
+            os.replace(temp_path, self.status_path)
+        except OSError as error:
+            self.record_error(error)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def record_error(self, error: Exception) -> None:
+        """ Records an error that did not stop the watcher, so it is shown in the status """
+        self.last_error = {"Image": None, "Status": f"error: {error!r}", "Time": datetime.now().isoformat()}
+
+    def shutdown(self) -> None:
+        """ Waits for the images being processed, records them and stops the worker pool """
+        if self.pool is None:
+            return
+        self.pool.shutdown(wait=True, cancel_futures=False)
+        self.collect()
+        self.write_status()
+        self.pool = None
+
+def ignore_interrupts() -> None:
+    """ Makes a worker process ignore Ctrl+C, so that the watcher can shut it down cleanly """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -1,6 +1,12 @@
 import unittest
 
 import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
 import cv2 as cv
 import numpy as np
 import pandas as pd
@@ -9,6 +15,16 @@ from unittest.mock import patch
 
 import ImageTransforming as it
 import ProcessSedimentCore as psc
+from ProfileCache import ProfileCache
+from ImageCache import ImageCache
+from CoreProfile import CoreProfile
+from LabTable import LabTable
+import LabTable as lt
+import ImageCache as ic
+import BatchProcessing as bp
+from WatchFolder import WatchFolder
+import ImportPool as ip
+import Decimation as dec
 
 class TestProcessSedimentCore(unittest.TestCase):
     def test_Scaling(self):
@@ -25,6 +41,24 @@ class TestProcessSedimentCore(unittest.TestCase):
         self.assertEqual(core.get_bounding_box(), [9, 484, 1902, 215])
         self.assertEqual(core.extract_core(from_bounding_box=True, bounding_box=None), 0)
 
+    def test_ExtractCore_pyramid(self):
+        cwd = os.getcwd()
+        for image_name in ['MI-24_03/SCREEN banner 96dpi-3148.jpg', 'MI-24_04/SCREEN banner 96dpi-3293.jpg']:
+            img = it.import_image(f'{cwd}/app/utils/image-data/{image_name}')
+            full_resolution = psc.ExtractCore(img, 10).get_bounding_box()
+            for pyramid_level in [1, 2, 3]:
+                core = psc.ExtractCore(img, 10, pyramid_level=pyramid_level, tolerance_px=4)
+                bounding_box = core.get_bounding_box()
+                self.assertTrue(np.abs(np.array(bounding_box) - full_resolution).max() <= 4)
+
+    def test_ExtractCore_pyramid_segments_edges_only(self):
+        img = it.import_image(f'{os.getcwd()}/app/utils/image-data/MI-24_04/SCREEN banner 96dpi-3293.jpg')
+        with patch.object(psc.transform, 'remove_greys', wraps=psc.transform.remove_greys) as mock_remove_greys:
+            psc.ExtractCore(img, 10, pyramid_level=2).get_bounding_box()
+        segmented = [call.args[0].size for call in mock_remove_greys.call_args_list]
+        self.assertEqual(len(segmented), 5) # the downscaled image and a strip around each edge
+        self.assertTrue(sum(segmented) < img.size / 2)
+
     def test_Colours(self):
         img = np.array([[[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 0], [0, 255, 255]],
                         [[255, 0, 255], [128, 128, 0], [0, 128, 128], [128, 0, 128], [64, 64, 64]],
@@ -34,6 +68,503 @@ class TestProcessSedimentCore(unittest.TestCase):
         colours = psc.Colours(image = img, scale=1.)
         self.assertEqual(colours.get_weights().all(), np.array([0, 1, 2, 1, 0]).all())
 
+    def test_Colours_vectorised_matches_per_row(self):
+        rng = np.random.default_rng(3200)
+        img = rng.integers(0, 256, size=(240, 37, 3), dtype=np.uint8)
+        colours = psc.Colours(image=img, scale=0.5)
+
+        # reference: the per-row, per-channel np.average implementation
+        colours.get_weights()
+        expected = np.array([[colours.get_weighted_avg_colour_channel(img[y, :, c]) for c in range(3)]
+                             for y in range(img.shape[0])])
+        expected_depths = [y * 0.5 for y in range(img.shape[0])]
+
+        result = colours.get_weighted_average_layer_colours(df=False)
+        self.assertTrue(np.array_equal(result, expected))
+
+        df = colours.get_weighted_average_layer_colours(df=True)
+        self.assertEqual(list(df.columns), ['Depth (mm)', 'Blue', 'Green', 'Red'])
+        self.assertEqual(list(df['Depth (mm)']), expected_depths)
+        self.assertTrue(np.array_equal(df[['Blue', 'Green', 'Red']].to_numpy(), expected))
+
+        result_32 = colours.get_weighted_average_layer_colours(df=False, dtype=np.float32)
+        self.assertEqual(result_32.dtype, np.float32)
+        self.assertTrue(np.abs(result_32 - expected).max() <= 1)
+
+    def test_Colours_parallel_matches_serial(self):
+        rng = np.random.default_rng(3200)
+        img = rng.integers(0, 256, size=(40, 1000, 3), dtype=np.uint8) # horizontal, oriented by Colours
+        serial = psc.Colours(image=img, scale=0.25).get_weighted_average_layer_colours(df=True)
+
+        colours = psc.Colours(image=img, scale=0.25, workers=3)
+        colours.parallel_min_rows = 100
+        colours.rows_per_band = 100
+        parallel = colours.get_weighted_average_layer_colours(df=True)
+        self.assertTrue(parallel.equals(serial))
+
+class TestProfileCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache = ProfileCache(self.cache_dir.name)
+        self.image = it.import_image(f'{os.getcwd()}/app/utils/image-data/MI-24_03/SCREEN banner 96dpi-3148.jpg')
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_process_core_image_uses_cache(self):
+        uncached = psc.process_core_image(self.image, 76)
+        first = psc.process_core_image(self.image, 76, cache=self.cache)
+        self.assertEqual(len(self.cache.get_entries()), 1)
+
+        with patch.object(psc.ExtractCore, 'extract_core') as mock_extract_core:
+            second = psc.process_core_image(self.image, 76, cache=self.cache)
+            mock_extract_core.assert_not_called()
+        for core in [first, second]:
+            self.assertTrue(core['Colours'].equals(uncached['Colours']))
+            self.assertEqual(core['Bounding Box'], uncached['Bounding Box'])
+            self.assertEqual(core['Scale'], uncached['Scale'])
+            self.assertEqual(core['Length (mm)'], uncached['Length (mm)'])
+            self.assertTrue(np.array_equal(core['Image'], uncached['Image']))
+
+        # a different core width is a different entry
+        psc.process_core_image(self.image, 50, cache=self.cache)
+        self.assertEqual(len(self.cache.get_entries()), 2)
+
+    def test_invalidate(self):
+        image_hash = ProfileCache.hash_image(self.image)
+        psc.process_core_image(self.image, 76, cache=self.cache, image_hash=image_hash)
+        psc.process_core_image(self.image, 50, cache=self.cache, image_hash=image_hash)
+        psc.process_core_image(self.image[:300], 76, cache=self.cache) # no core in this image
+        self.assertEqual(len(self.cache.get_entries()), 3)
+        self.assertEqual(self.cache.invalidate(image_hash), 2)
+        self.assertEqual(self.cache.invalidate(), 1)
+        self.assertEqual(self.cache.get_entries(), [])
+
+    def test_evict_least_recently_used(self):
+        colours = pd.DataFrame(np.zeros((1000, 4)), columns=['Depth (mm)', 'Blue', 'Green', 'Red'])
+        core = {"Length (mm)": 1., "Colours": colours, "Scale": 1., "Bounding Box": [0, 0, 1, 1]}
+        for key in ['a', 'b', 'c']:
+            self.cache.put(key, 'params', core)
+        entry_size = self.cache.get_size() // 3
+        os.utime(self.cache.get_entry_path('a', 'params'), (1, 1))
+        os.utime(self.cache.get_entry_path('b', 'params'), (3, 3))
+        os.utime(self.cache.get_entry_path('c', 'params'), (2, 2))
+        self.assertIsNotNone(self.cache.get('a', 'params')) # 'a' is now the most recently used
+
+        self.cache.max_bytes = 2 * entry_size
+        self.cache.evict()
+        self.assertIsNone(self.cache.get('c', 'params'))
+        self.assertIsNotNone(self.cache.get('a', 'params'))
+        self.assertIsNotNone(self.cache.get('b', 'params'))
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache = ImageCache(self.cache_dir.name)
+        self.image_path = f'{os.getcwd()}/app/utils/image-data/MI-24_03/SCREEN banner 96dpi-3148.jpg'
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_read_reduced(self):
+        image = ic.read_reduced(self.image_path, 200)
+        full = cv.imread(self.image_path)
+        self.assertEqual(max(image.shape[:2]), 200)
+        self.assertAlmostEqual(image.shape[1] / image.shape[0], full.shape[1] / full.shape[0], places=1)
+        self.assertIsNone(ic.read_reduced(f'{self.cache_dir.name}/missing.jpg', 200))
+
+    def test_get_image_uses_cache(self):
+        first = self.cache.get_image(self.image_path, 100)
+        self.assertEqual(len(self.cache.get_entries()), 1)
+        with patch.object(ic, 'read_reduced') as mock_read_reduced:
+            second = self.cache.get_image(self.image_path, 100)
+            mock_read_reduced.assert_not_called()
+        self.assertEqual(first.shape, second.shape)
+
+        # a different size is a different entry
+        self.cache.get_image(self.image_path, 300)
+        self.assertEqual(len(self.cache.get_entries()), 2)
+
+    def test_fill_from_decoded_image(self):
+        with patch.object(self.cache, 'evict', wraps=self.cache.evict) as mock_evict:
+            self.cache.fill(self.image_path, cv.imread(self.image_path))
+            self.assertEqual(mock_evict.call_count, 1)
+        self.assertEqual(len(self.cache.get_entries()), 2)
+        with patch.object(ic, 'read_reduced') as mock_read_reduced:
+            preview = self.cache.get_image(self.image_path, ImageCache.preview_size)
+            thumbnail = self.cache.get_image(self.image_path, ImageCache.thumbnail_size)
+            mock_read_reduced.assert_not_called()
+        self.assertEqual(max(preview.shape[:2]), ImageCache.preview_size)
+        self.assertEqual(max(thumbnail.shape[:2]), ImageCache.thumbnail_size)
+
+    def test_modified_image_is_read_again(self):
+        image_path = shutil.copy(self.image_path, self.cache_dir.name)
+        entry_path = self.cache.get_entry_path(image_path, 100)
+        self.cache.get_image(image_path, 100)
+        os.utime(image_path, ns=(0, 0))
+        self.assertNotEqual(self.cache.get_entry_path(image_path, 100), entry_path)
+        self.assertIsNone(self.cache.get_image(f'{self.cache_dir.name}/missing.jpg', 100))
+
+class TestBatchProcessing(unittest.TestCase):
+    def setUp(self):
+        self.image_dir = f'{os.getcwd()}/app/utils/image-data/MI-24_03'
+        self.output_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.output_dir.cleanup()
+
+    def test_find_images(self):
+        self.assertEqual(len(bp.find_images([self.image_dir])), 14)
+        images = bp.find_images([f'{self.image_dir}/*3148*.jpg', f'{self.image_dir}/SCREEN banner 96dpi-3148.jpg'])
+        self.assertEqual([os.path.basename(image) for image in images],
+                         ['SCREEN banner 96dpi-3148-2.jpg', 'SCREEN banner 96dpi-3148.jpg'])
+        self.assertEqual(bp.find_images([f'{os.getcwd()}/app/utils/image-data'], recursive=False), [])
+
+    def test_get_output_names(self):
+        names = bp.get_output_names(['a/core.jpg', 'b/core.jpg', 'b/other.png'])
+        self.assertEqual(list(names.values()), ['a_core.csv', 'b_core.csv', 'other.csv'])
+
+        manifest = {'c/core.jpg': {"Summary": {"Profile": 'out/core.csv'}},
+                    'b/other.png': {"Summary": {"Profile": 'out/b_other.csv'}}}
+        names = bp.get_output_names(['d/core.jpg', 'b/other.png'], manifest)
+        self.assertRegex(names['d/core.jpg'], r'^core-[0-9a-f]{8}\.csv$')
+        self.assertEqual(names['b/other.png'], 'b_other.csv')
+
+    def test_run_batch(self):
+        images = bp.find_images([f'{self.image_dir}/*3148*.jpg'])
+        summary = bp.run_batch(images + ['missing.jpg'], self.output_dir.name, workers=1)
+        self.assertEqual(list(summary['Status'][:2]), ['processed', 'processed'])
+        self.assertTrue(summary['Status'][2].startswith('failed'))
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir.name, 'summary.csv')))
+
+        profile = pd.read_csv(summary['Profile'][1])
+        self.assertEqual(list(profile.columns), ['Depth (mm)', 'Blue', 'Green', 'Red', 'L', 'a', 'b'])
+        self.assertEqual(len(profile), summary['Layers'][1])
+
+    def test_run_batch_incremental(self):
+        input_dir = os.path.join(self.output_dir.name, 'scans')
+        output_dir = os.path.join(self.output_dir.name, 'profiles')
+        os.makedirs(input_dir)
+        for image_name in ['SCREEN banner 96dpi-3148.jpg', 'SCREEN banner 96dpi-3152.jpg']:
+            shutil.copy(f'{self.image_dir}/{image_name}', input_dir)
+        first = bp.run_batch(bp.find_images([input_dir]), output_dir, workers=1)
+        self.assertEqual(list(first['Status']), ['processed', 'processed'])
+
+        second = bp.run_batch(bp.find_images([input_dir]), output_dir, workers=1)
+        self.assertEqual(list(second['Status']), ['skipped', 'skipped'])
+        self.assertEqual(list(second['Profile']), list(first['Profile']))
+        self.assertIn('0 processed, 2 skipped, 0 failed, 0 pruned', bp.get_run_report(second))
+
+        # replace one image and delete the other
+        shutil.copy(f'{self.image_dir}/SCREEN banner 96dpi-3165.jpg', f'{input_dir}/SCREEN banner 96dpi-3148.jpg')
+        os.remove(f'{input_dir}/SCREEN banner 96dpi-3152.jpg')
+        third = bp.run_batch(bp.find_images([input_dir]), output_dir, workers=1)
+        self.assertEqual(list(third['Status']), ['processed'])
+        self.assertEqual(third.attrs['Pruned'], 1)
+        self.assertFalse(os.path.exists(first['Profile'][1]))
+        self.assertEqual(list(bp.load_manifest(output_dir)), list(third['Image']))
+
+    def test_run_batch_same_name_across_runs(self):
+        output_dir = os.path.join(self.output_dir.name, 'profiles')
+        for folder, image_name in [('A', 'SCREEN banner 96dpi-3148.jpg'), ('B', 'SCREEN banner 96dpi-3165.jpg')]:
+            os.makedirs(os.path.join(self.output_dir.name, folder))
+            shutil.copy(f'{self.image_dir}/{image_name}', os.path.join(self.output_dir.name, folder, 'core.jpg'))
+        image_a, image_b = [os.path.join(self.output_dir.name, folder, 'core.jpg') for folder in 'AB']
+
+        first = bp.run_batch([image_a], output_dir, workers=1)
+        second = bp.run_batch([image_b], output_dir, workers=1)
+        self.assertNotEqual(second['Profile'][0], first['Profile'][0])
+
+        # the profile of the first image was not overwritten by the second run
+        rerun = bp.run_batch([image_a], output_dir, workers=1)
+        self.assertEqual(list(rerun['Status']), ['skipped'])
+        self.assertEqual(rerun['Profile'][0], first['Profile'][0])
+        self.assertEqual(len(pd.read_csv(rerun['Profile'][0])), rerun['Layers'][0])
+
+        # pruning the first image does not delete the profile of the second
+        os.remove(image_a)
+        third = bp.run_batch([image_b], output_dir, workers=1)
+        self.assertEqual((list(third['Status']), third.attrs['Pruned']), (['skipped'], 1))
+        self.assertFalse(os.path.exists(first['Profile'][0]))
+        self.assertEqual(len(pd.read_csv(third['Profile'][0])), third['Layers'][0])
+
+    def test_prune_manifest_keeps_shared_profiles(self):
+        profile = os.path.join(self.output_dir.name, 'core.csv')
+        open(profile, 'w').close()
+        entry = {"Summary": {"Profile": profile}}
+        manifest = {'missing.jpg': entry, self.image_dir: entry}
+        self.assertEqual(bp.prune_manifest(manifest), 1)
+        self.assertTrue(os.path.exists(profile))
+
+    def test_recalibrate_batch(self):
+        images = bp.find_images([f'{self.image_dir}/SCREEN banner 96dpi-3148.jpg'])
+        first = bp.run_batch(images, self.output_dir.name, workers=1)
+        fresh_dir = os.path.join(self.output_dir.name, 'fresh')
+        fresh = bp.run_batch(images, fresh_dir, core_width_mm=50, workers=1)
+
+        with patch.object(bp, 'process_core_image') as mock_process:
+            summary = bp.recalibrate_batch(self.output_dir.name, {images[0]: 50, 'missing.jpg': 50})
+            mock_process.assert_not_called()
+        self.assertEqual(list(summary['Status']), ['recalibrated', 'not processed'])
+        self.assertAlmostEqual(summary['Length (mm)'][0], fresh['Length (mm)'][0])
+        self.assertAlmostEqual(summary['Scale'][0], fresh['Scale'][0])
+        recalibrated, expected = pd.read_csv(first['Profile'][0]), pd.read_csv(fresh['Profile'][0])
+        self.assertTrue(np.allclose(recalibrated['Depth (mm)'], expected['Depth (mm)']))
+        self.assertTrue(recalibrated.drop(columns='Depth (mm)').equals(expected.drop(columns='Depth (mm)')))
+
+        # the profile is up to date for the new width
+        second = bp.run_batch(images, self.output_dir.name, core_width_mm=50, workers=1)
+        self.assertEqual(list(second['Status']), ['skipped'])
+
+    def test_recalibrate_batch_keeps_parameters(self):
+        images = bp.find_images([f'{self.image_dir}/SCREEN banner 96dpi-3148.jpg'])
+        bp.run_batch(images, self.output_dir.name, workers=1, pixel_lab=True)
+        summary = bp.recalibrate_batch(self.output_dir.name, {images[0]: 50})
+        self.assertEqual(list(summary['Status']), ['recalibrated'])
+        self.assertEqual(list(bp.run_batch(images, self.output_dir.name, core_width_mm=50, workers=1, pixel_lab=True)['Status']),
+                         ['skipped'])
+
+        manifest = bp.load_manifest(self.output_dir.name)
+        self.assertNotEqual(manifest[images[0]]["Parameter Hash"], bp.get_parameter_hash(50, 2))
+
+        # without stored parameters, the given ones must be the ones the profile was made with
+        del manifest[images[0]]["Parameters"]
+        bp.save_manifest(self.output_dir.name, manifest)
+        summary = bp.recalibrate_batch(self.output_dir.name, {images[0]: 60})
+        self.assertEqual(list(summary['Status']), ['parameters differ'])
+        summary = bp.recalibrate_batch(self.output_dir.name, {images[0]: 60}, pixel_lab=True)
+        self.assertEqual(list(summary['Status']), ['recalibrated'])
+        self.assertEqual(list(bp.run_batch(images, self.output_dir.name, core_width_mm=60, workers=1)['Status']),
+                         ['processed'])
+
+    def test_WatchFolder(self):
+        watch_dir = os.path.join(self.output_dir.name, 'scans')
+        output_dir = os.path.join(self.output_dir.name, 'profiles')
+        os.makedirs(watch_dir)
+        watcher = WatchFolder(watch_dir, output_dir, workers=1, settle_seconds=0)
+        shutil.copy(f'{self.image_dir}/SCREEN banner 96dpi-3148.jpg', watch_dir)
+        with open(os.path.join(watch_dir, 'broken.jpg'), 'w') as file:
+            file.write('not an image')
+
+        watcher.poll() # first sighting of the files
+        self.assertEqual(watcher.get_status()['Settling'], 2)
+        deadline = time.monotonic() + 60
+        while watcher.counts['Processed'] + watcher.counts['Failed'] < 2 and time.monotonic() < deadline:
+            watcher.poll()
+            time.sleep(0.05)
+        watcher.shutdown()
+
+        with open(watcher.status_path) as file:
+            status = json.load(file)
+        self.assertEqual((status['Processed'], status['Failed'], status['Queue Depth']), (1, 1, 0))
+        self.assertTrue(status['Last Error']['Image'].endswith('broken.jpg'))
+        self.assertIsNotNone(status['Latency (s)']['Mean'])
+        self.assertTrue(os.path.exists(os.path.join(output_dir, 'SCREEN banner 96dpi-3148.csv')))
+
+        # a restarted watcher skips the image that is already up to date
+        restarted = WatchFolder(watch_dir, output_dir, workers=1, settle_seconds=0)
+        restarted.poll()
+        restarted.poll()
+        restarted.shutdown()
+        self.assertEqual(restarted.counts['Skipped'], 1)
+
+    def test_WatchFolder_survives_filesystem_errors(self):
+        watch_dir = os.path.join(self.output_dir.name, 'scans')
+        os.makedirs(watch_dir)
+        status_path = os.path.join(self.output_dir.name, 'status.json')
+        os.makedirs(status_path) # the status cannot be moved into place
+        watcher = WatchFolder(watch_dir, os.path.join(self.output_dir.name, 'profiles'), workers=1,
+                              poll_interval=0.05, status_path=status_path)
+        watcher.poll()
+        self.assertIn('IsADirectoryError', watcher.last_error['Status'])
+        self.assertFalse(os.path.exists(f'{status_path}.tmp'))
+
+        with patch.object(watcher, 'scan', side_effect=OSError('share unavailable')) as mock_scan:
+            watcher.run(duration=0.3)
+        self.assertGreater(mock_scan.call_count, 1)
+        self.assertIsNone(watcher.pool) # shut down cleanly at the end of the run
+
+    def test_WatchFolder_same_name(self):
+        watch_dir = os.path.join(self.output_dir.name, 'scans')
+        output_dir = os.path.join(self.output_dir.name, 'profiles')
+        os.makedirs(watch_dir)
+        earlier = bp.run_batch([f'{self.image_dir}/SCREEN banner 96dpi-3152.jpg'], output_dir, workers=1)
+        for image_name, scan_name in [('3148.jpg', 'SCREEN banner 96dpi-3152.jpg'), ('3165.jpg', 'SCREEN banner 96dpi-3152.png')]:
+            cv.imwrite(os.path.join(watch_dir, scan_name), cv.imread(f'{self.image_dir}/SCREEN banner 96dpi-{image_name}'))
+
+        watcher = WatchFolder(watch_dir, output_dir, workers=2, settle_seconds=0)
+        watcher.poll()
+        deadline = time.monotonic() + 60
+        while watcher.counts['Processed'] < 2 and time.monotonic() < deadline:
+            watcher.poll()
+            time.sleep(0.05)
+        watcher.shutdown()
+
+        profiles = [entry["Summary"]["Profile"] for entry in bp.load_manifest(output_dir).values()]
+        self.assertEqual(len(set(profiles)), 3)
+        self.assertEqual(profiles[0], earlier['Profile'][0])
+        for entry in bp.load_manifest(output_dir).values():
+            self.assertEqual(len(pd.read_csv(entry["Summary"]["Profile"])), entry["Summary"]["Layers"])
+
+    def test_headless(self):
+        code = ("import sys, app.utils.BatchProcessing; "
+                "sys.exit(any(m.startswith(('PyQt6', 'matplotlib.backends.backend_qt')) for m in sys.modules))")
+        self.assertEqual(subprocess.run([sys.executable, '-c', code], cwd=os.getcwd()).returncode, 0)
+
+class TestImportPool(unittest.TestCase):
+    def test_shared_memory_round_trip(self):
+        array = np.arange(60, dtype=np.uint8).reshape(5, 4, 3)
+        reference = ip.to_shared_memory(array)
+        self.assertTrue(np.array_equal(ip.from_shared_memory(reference), array))
+        with self.assertRaises(FileNotFoundError): # the block is freed once it is read
+            ip.from_shared_memory(reference)
+
+    def test_import_matches_process_core_image(self):
+        image_path = f'{os.getcwd()}/app/utils/image-data/MI-24_03/SCREEN banner 96dpi-3148.jpg'
+        pool = ip.ImportPool(workers=1)
+        try:
+            core = ip.ImportPool.collect(pool.submit(image_path))
+        finally:
+            pool.shutdown()
+        expected = psc.process_core_image(it.orient_array(it.import_image(image_path)), 76, pyramid_level=2)
+        self.assertTrue(np.array_equal(core['Image'], expected['Image']))
+        self.assertTrue(np.array_equal(core['Preview'], ic.shrink(cv.imread(image_path), ImageCache.preview_size)))
+        expected_df = it.core_to_rgb_and_lab(expected['Colours'])
+        self.assertEqual(list(core['Profile'].to_dataframe().columns), list(expected_df.columns))
+        for column in expected_df.columns:
+            self.assertTrue(np.array_equal(core['Profile'][column], expected_df[column]))
+
+    def test_workers_do_not_import_qt(self):
+        # spawned workers import the main module again, so the GUI entry point is the main module here
+        code = ("import sys, __main__; __main__.__file__ = 'main.py'\n"
+                "from app.utils.ImportPool import ImportPool\n"
+                "pool = ImportPool(workers=1)\n"
+                "modules = pool.executor.submit(eval, \"list(__import__('sys').modules)\").result()\n"
+                "pool.shutdown()\n"
+                "sys.exit(any(m.startswith(('PyQt6', 'matplotlib.backends.backend_qt')) for m in modules))")
+        self.assertEqual(subprocess.run([sys.executable, '-c', code], cwd=os.getcwd()).returncode, 0)
+
+class TestCoreProfile(unittest.TestCase):
+    def setUp(self):
+        image = it.orient_array(it.import_image(f'{os.getcwd()}/app/utils/image-data/MI-24_03/SCREEN banner 96dpi-3148.jpg'))
+        self.core = psc.process_core_image(image, 76, df=False, pyramid_level=2)
+        self.df = it.core_to_rgb_and_lab(psc.process_core_image(image, 76, pyramid_level=2)['Colours'])
+
+    def test_from_colours_matches_dataframe(self):
+        profile = CoreProfile.from_colours(self.core['Colours'], self.core['Scale'])
+        self.assertEqual(len(profile), len(self.df))
+        self.assertEqual(profile.bgr.dtype, np.uint8)
+        self.assertEqual(profile.lab.dtype, np.float32)
+        for column in self.df.columns:
+            self.assertTrue(np.array_equal(profile[column], self.df[column]))
+
+    def test_dataframe_round_trip(self):
+        profile = CoreProfile.from_dataframe(self.df)
+        df = profile.to_dataframe()
+        self.assertEqual(list(df.columns), list(self.df.columns))
+        self.assertTrue(np.shares_memory(df['Red'].to_numpy(), profile.bgr)) # the DataFrame is a view of the profile
+        self.assertTrue(np.array_equal(CoreProfile.from_dataframe(df).lab, profile.lab))
+        with self.assertRaises(AttributeError):
+            profile.notes = 'profiles have no __dict__'
+
+    def test_colour_spaces_are_converted_once(self):
+        profile = CoreProfile.from_colours(self.core['Colours'], self.core['Scale'])
+        self.assertEqual(profile.colour_spaces, {})
+        hsv = profile.get_colour_space('HSV')
+        self.assertIs(profile.get_colour_space('HSV'), hsv)
+        self.assertEqual(list(profile.colour_spaces), ['HSV'])
+        self.assertEqual(hsv.shape, (len(profile), 3))
+        self.assertEqual(profile.get_colour_space('Grey').shape, (len(profile), 1))
+        first = profile.bgr[:1].reshape(1, 1, 3)
+        self.assertTrue(np.allclose(profile['Hue'][0], cv.cvtColor(first.astype(np.float32) / 255, cv.COLOR_BGR2HSV)[0, 0, 0]))
+        df = profile.to_dataframe(['XYZ', 'Grey'])
+        self.assertEqual(list(df.columns), ['Depth (mm)', 'X', 'Y', 'Z', 'Grey'])
+
+    def test_flip_is_a_view(self):
+        profile = CoreProfile.from_colours(self.core['Colours'], self.core['Scale'])
+        depth = profile.depth.copy()
+        profile.flip()
+        flipped = profile['Depth (mm)']
+        self.assertTrue(np.shares_memory(flipped, profile.depth))
+        self.assertTrue(np.allclose(flipped, depth.max() - depth))
+        self.assertTrue(np.array_equal(profile.depth, depth))
+        self.assertTrue(np.array_equal(profile['Red'], self.df['Red'])) # the layers keep their colours
+        self.assertEqual(profile.to_dataframe()['Depth (mm)'].iloc[0], depth.max())
+        profile.flip()
+        self.assertIs(profile['Depth (mm)'], profile.depth)
+
+    def test_rescale(self):
+        profile = CoreProfile.from_colours(self.core['Colours'], self.core['Scale'])
+        flipped = profile['Depth (mm)'][::-1]
+        profile.rescale(0.5)
+        self.assertAlmostEqual(profile.get_scale(), 0.5)
+        self.assertTrue(np.allclose(profile.depth, np.arange(len(profile)) * 0.5))
+        self.assertTrue(np.array_equal(flipped, profile.depth[::-1])) # views of the depths follow
+        self.assertTrue(np.array_equal(profile['Red'], self.df['Red']))
+
+class TestLabTable(unittest.TestCase):
+    def setUp(self):
+        self.table_dir = tempfile.TemporaryDirectory()
+        self.table = LabTable(self.table_dir.name)
+        self.pixels = np.random.default_rng(0).integers(0, 256, (50, 40, 3), dtype=np.uint8)
+
+    def tearDown(self):
+        lt.loaded_tables.pop(self.table.table_path, None)
+        self.table_dir.cleanup()
+
+    def test_convert_matches_opencv(self):
+        lab = self.table.convert(self.pixels)
+        expected = it.bgr_to_lab(self.pixels.reshape(-1, 3)).reshape(self.pixels.shape)
+        self.assertEqual(lab.shape, self.pixels.shape)
+        self.assertLessEqual(np.abs(lab - expected).max(), 0.5 / LabTable.scale + 1e-4)
+
+        # the table is built once and then read by every table with the same path
+        self.assertTrue(os.path.exists(self.table.table_path))
+        lt.loaded_tables.pop(self.table.table_path)
+        with patch.object(LabTable, 'build') as mock_build:
+            self.assertTrue(np.array_equal(LabTable(self.table_dir.name).convert(self.pixels), lab))
+            mock_build.assert_not_called()
+
+    def test_convert_without_table(self):
+        table = LabTable(os.path.join(self.table.table_path, 'not a directory'))
+        self.table.get_table() # the table path is a file, so the table cannot be built under it
+        self.assertIsNone(table.get_table())
+        expected = it.bgr_to_lab(self.pixels.reshape(-1, 3)).reshape(self.pixels.shape)
+        self.assertTrue(np.allclose(table.convert(self.pixels), expected))
+
+    def test_pixel_lab_averages(self):
+        # each row is two colours, so the average of their CIELAB colours is not the CIELAB of their average colour
+        image = np.zeros((8, 6, 3), dtype=np.uint8)
+        image[:, :3] = [200, 30, 10]
+        image[:, 3:] = [10, 220, 240]
+        colours = psc.Colours(image, 0.5)
+        lab = colours.get_weighted_average_layer_lab(self.table)
+        weights = colours.weights / colours.weights.sum()
+        expected = weights @ it.bgr_to_lab(image[0])
+        self.assertEqual(lab.shape, (8, 3))
+        self.assertTrue(np.allclose(lab, expected, atol=0.01))
+        average_lab = it.bgr_to_lab(colours.get_weighted_average_layer_colours(df=False)[:1])
+        self.assertFalse(np.allclose(lab[0], average_lab[0], atol=1))
+
+class TestDecimation(unittest.TestCase):
+    def test_get_visible_slice(self):
+        depth = np.arange(100) * 0.5
+        visible = dec.get_visible_slice(depth, 10, 20)
+        self.assertEqual((visible.start, visible.stop), (19, 42))
+        self.assertEqual(dec.get_visible_slice(depth, 20, 10), visible)
+        flipped = dec.get_visible_slice(depth[::-1], 10, 20)
+        self.assertTrue(np.array_equal(np.sort(depth[::-1][flipped]), depth[visible]))
+        self.assertEqual(dec.get_visible_slice(depth, -10, 1000), slice(0, 100))
+
+    def test_get_min_max_envelope(self):
+        values = np.random.default_rng(0).normal(size=100000)
+        values[[12345, 67890]] = [50, -50]
+        indices = dec.get_min_max_envelope(values, 300)
+        self.assertLessEqual(len(indices), 4 * 300)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        self.assertTrue({0, 12345, 67890, 99999} <= set(indices.tolist()))
+        self.assertTrue(np.array_equal(dec.get_min_max_envelope(values[:1000], 300), np.arange(1000)))
+
 class TestImageFunctions(unittest.TestCase):
 
     @patch('cv2.imread')
@@ -71,6 +602,23 @@ class TestImageFunctions(unittest.TestCase):
         contours = it.get_contours(image)
         self.assertTrue(len(contours) > 0)
 
+    def test_get_binary_mask(self):
+        grey = np.zeros((300, 40), dtype=np.uint8)
+        grey[100:200, 10:30] = 255
+        threshold, binary = it.get_binary_mask(grey, blur_size=11)
+        self.assertEqual(binary.shape, grey.shape)
+        self.assertEqual(binary[150, 20], 255)
+        self.assertEqual(binary[10, 20], 0)
+        # tall images are blurred transposed, which must not change the result
+        _, binary_wide = it.get_binary_mask(np.ascontiguousarray(grey.T), blur_size=11, threshold=threshold)
+        self.assertTrue(np.array_equal(binary, binary_wide.T))
+
+    def test_downscale_image(self):
+        image = np.ones((100, 60, 3), dtype=np.uint8)
+        self.assertEqual(it.downscale_image(image, 2).shape, (25, 15, 3))
+        self.assertEqual(it.scale_kernel_size(101, 4), 25)
+        self.assertEqual(it.scale_kernel_size(101, 2), 51)
+
     def test_crop_image(self):
         image = np.ones((100, 100, 3), dtype=np.uint8)
         cropped = it.crop_image(image, [10, 10, 50, 50])
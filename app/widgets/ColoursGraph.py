@@ -5,10 +5,15 @@ matplotlib.use('QtAgg')
 import matplotlib.axes
 import matplotlib.figure
 import numpy as np
-import pandas as pd
+from collections import OrderedDict
+from PyQt6.QtCore import QTimer
 from matplotlib.ticker import MaxNLocator
 from matplotlib.widgets import SpanSelector
 
+from app.utils.Decimation import get_visible_slice, get_min_max_envelope
+from app.widgets.DepthCursor import DepthCursor
+from app.utils.CoreProfile import CoreProfile
+
 
 #import FigureCanvasQTAGG - a class used as a widget which displays matplotlib plots in pyqt
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
@@ -31,8 +36,10 @@ class ColoursGraph(FigureCanvasQTAgg):
     label_max_font_size = 14.5
     axes_min_width = 0.35
     base_font_size = 10
+    layout_delay_ms = 50
+    layout_cache_size = 32
 
-    def __init__(self, parent:classmethod=None, dpi:int=100, df:pd.DataFrame = None,analysis_type:str = 'rgb',units:str = '%'):
+    def __init__(self, parent:classmethod=None, dpi:int=100, profile:CoreProfile = None,analysis_type:str = 'rgb',units:str = '%'):
         """ 
         Initialisation function for the ColourGraph PyQt Widget.
 
@@ -41,18 +48,32 @@ class ColoursGraph(FigureCanvasQTAgg):
             width(int): The width of the matplotlib figure. 
             height(int): The height of the matplot figure. 
             dpi(int): matplotlib resolution settings - Dots Per Inch. 
-            df(pd.Dataframe): A Pandas Dataframe containing the data to be displayed. 
+            profile(CoreProfile): The depths and colours of the core to be displayed. 
         """
-        self.df = df
+        self.profile = profile
         self.analysis_type = analysis_type
         self.hline = None
         self.units = units 
+        self.lines = []
+        self.plot_depth = None
+        self.plot_values = []
+        self.plot_data_cache = {} # (analysis type, units) -> converted data from getPlotData
+        self.flipped = profile.flipped # the orientation of the profile that is drawn
+        self.layout_label_width = None # the widest depth tick label when the figure was last laid out
         self.fig = Figure(dpi=dpi)
+        self.depth_cursor = DepthCursor(self.fig)
         self.createSubplots()
         self.plotColourData()
         self.fig.canvas.mpl_connect('button_press_event', self.onClick)
-        self.fig.canvas.mpl_connect('resize_event',self.resizeEvent) #connecting resize event to graph
         super(ColoursGraph, self).__init__(self.fig)
+
+        #the layout is recalculated once resizing pauses, and cached for each canvas size
+        self.layout_cache = OrderedDict()
+        self.layout_listeners = []
+        self.layout_timer = QTimer(self)
+        self.layout_timer.setSingleShot(True)
+        self.layout_timer.setInterval(self.layout_delay_ms)
+        self.layout_timer.timeout.connect(self.applyLayout)
     
     def createSubplots(self):
         """
@@ -71,16 +92,16 @@ class ColoursGraph(FigureCanvasQTAgg):
     
     def plotColourData(self):
         """
-        Function which iterative plots data from an inputted pandas dataframe onto three subplots.
-
-        parameters:
-            df(pd.Dataframe): the pandas dataframe with the colour data to be plotted
+        Function which iterative plots the colour data of the profile onto three subplots.
         """
-        depth,colour_data_list,colour_name_list,plot_line_colour_list = self.getPlotData()
+        # The full resolution data is kept, and only the level of detail that fits on screen is drawn
+        self.plot_depth,self.plot_values,colour_name_list,plot_line_colour_list = self.getCachedPlotData()
+        self.lines = []
 
-        for ax, colour_data,colour_name,plot_line_colour in zip(self.fig.axes,colour_data_list,colour_name_list,plot_line_colour_list):
+        for ax, colour_data,colour_name,plot_line_colour in zip(self.fig.axes,self.plot_values,colour_name_list,plot_line_colour_list):
 
-            ax.plot(colour_data, depth,color = plot_line_colour)
+            line_depth, line_data = self.getLevelOfDetail(ax, colour_data, (self.plot_depth[0], self.plot_depth[-1]))
+            self.lines.extend(ax.plot(line_data, line_depth,color = plot_line_colour))
 
             ax.set_title(colour_name, fontweight='bold',pad = 10)
 
@@ -99,6 +120,152 @@ class ColoursGraph(FigureCanvasQTAgg):
         self.axes_left.set_ylabel('Depth (mm)',fontweight = 'bold')
         self.setPlotXlabel()
 
+        #creating the depth cursor, which is removed when the subplots are cleared
+        self.depth_cursor.setAxes(self.fig.axes, readout_axes = self.axes_left)
+
+        # Zooming or panning any of the (shared) axes fetches the data for the new depth range.
+        # Callbacks are cleared by cla(), so they are connected each time the data is plotted
+        for ax in self.fig.axes:
+            ax.callbacks.connect('ylim_changed', self.onYlimChanged)
+
+    def replotColourData(self):
+        """
+        Function which shows the data for the current analysis type and units on the existing lines,
+        keeping the axes, ticks, grid and zoom rather than clearing and rebuilding the subplots.
+        """
+        self.plot_depth,self.plot_values,colour_name_list,plot_line_colour_list = self.getCachedPlotData()
+
+        for ax, line, colour_data, colour_name, plot_line_colour in zip(self.fig.axes,self.lines,self.plot_values,colour_name_list,plot_line_colour_list):
+            # The x limits are fitted to the whole core, not only the visible depth range
+            line_depth, line_data = self.getLevelOfDetail(ax, colour_data, (self.plot_depth[0], self.plot_depth[-1]))
+            line.set_data(line_data, line_depth)
+            line.set_color(plot_line_colour)
+            ax.title.set_text(colour_name)
+            ax.relim()
+
+        # The subplots share their x axis, so it is fitted to all of them at once
+        self.setPlotXlim(self.axes_left)
+
+        self.addFigureTitle(fontsize = self.figure_title_fontsize)
+        self.setPlotXlabel()
+        self.updateLevelOfDetail()
+
+    def setOrientation(self):
+        """
+        Function showing the profile in its current orientation after it has been flipped.
+
+        The depths of a flipped profile are a reversed view of its depths, so no colour data is 
+        converted: the existing lines are redrawn at the level of detail for the new depths, and the 
+        depth range is mirrored so the graphs keep showing the same layers, now from the other end.
+        """
+        if self.flipped == self.profile.flipped:
+            return
+        self.flipped = self.profile.flipped
+        self.setPlotDepth()
+
+        # A layer at depth d is now at depth (first + last - d)
+        mirror = self.plot_depth[0] + self.plot_depth[-1]
+        self.moveDepths(lambda depth: mirror - depth)
+
+    def rescaleDepths(self, ratio:float):
+        """
+        Function showing the profile after its depths have been multiplied by `ratio`, when the width of 
+        the core is corrected (see CoreProfile.rescale). As with flipping, no colour data is converted, 
+        the existing lines are redrawn and the depth range is scaled to keep showing the same layers.
+        """
+        self.setPlotDepth()
+        self.moveDepths(lambda depth: depth * ratio)
+
+    def setPlotDepth(self):
+        """
+        Function replacing the depths of the cached plot data with the current depths of the profile.
+        """
+        depth = np.asarray(self.profile['Depth (mm)'], dtype=float)
+        for key, (_, colour_data_list, colour_name_list, plot_line_colour_list) in self.plot_data_cache.items():
+            self.plot_data_cache[key] = (depth, colour_data_list, colour_name_list, plot_line_colour_list)
+        self.plot_depth = depth
+
+    def moveDepths(self, move):
+        """
+        Function moving the depth range and the clicked depth line to the new depths of the layers
+        they were at, given a function from the old depth of a layer to its new depth, then redrawing the lines.
+        """
+        lower, upper = (move(limit) for limit in self.axes_left.get_ylim())
+        # The depth axis keeps increasing downwards
+        self.axes_left.set_ylim(max(lower, upper), min(lower, upper))
+        for line in self.hline or []:
+            line.set_ydata([move(depth) for depth in line.get_ydata()])
+        self.updateLevelOfDetail()
+
+    def showCursor(self, depth:float):
+        """
+        Function moving the depth cursor to a depth and showing the colour values of the nearest layer in its readout.
+        """
+        if self.plot_depth is None or len(self.plot_depth) == 0:
+            return
+        index = self.getDepthIndex(depth)
+        _,_,colour_name_list,_ = self.getCachedPlotData()
+        readout = f'{self.plot_depth[index]:.1f} mm  ' + '  '.join(
+            f'{colour_name} {values[index]:.1f}' for colour_name, values in zip(colour_name_list, self.plot_values))
+        self.depth_cursor.setDepth(depth, readout)
+
+    def getDepthIndex(self, depth:float)->int:
+        """
+        Function returning the index of the layer nearest to a depth, using a binary search of the (monotonic) depths.
+        """
+        depths = self.plot_depth
+        if len(depths) == 1:
+            return 0
+        descending = depths[0] > depths[-1]
+        if descending:
+            depths = depths[::-1]
+        index = int(np.clip(np.searchsorted(depths, depth), 1, len(depths) - 1))
+        if depth - depths[index - 1] < depths[index] - depth:
+            index -= 1
+        return len(depths) - 1 - index if descending else index
+
+    def getCachedPlotData(self)->tuple:
+        """
+        Function returning the data from getPlotData as arrays, converting it only the first time 
+        each analysis type and units are shown.
+        """
+        key = (self.analysis_type, self.units)
+        if key not in self.plot_data_cache:
+            depth,colour_data_list,colour_name_list,plot_line_colour_list = self.getPlotData()
+            self.plot_data_cache[key] = (np.asarray(depth, dtype=float),
+                                         [np.asarray(colour_data, dtype=float) for colour_data in colour_data_list],
+                                         colour_name_list, plot_line_colour_list)
+        return self.plot_data_cache[key]
+
+    def getLevelOfDetail(self, ax:matplotlib.axes.Axes, values:np.ndarray, ylim:tuple)->tuple:
+        """
+        Function returning the depths and values of a line to draw for the visible depth range. 
+        When there are more samples than pixel rows in the axes, the minimum and maximum 
+        of the samples in each pixel row are drawn, so that peaks stay visible.
+        """
+        visible = get_visible_slice(self.plot_depth, *ylim)
+        indices = get_min_max_envelope(values[visible], ax.bbox.height) + visible.start
+        return self.plot_depth[indices], values[indices]
+
+    def updateLevelOfDetail(self):
+        """
+        Function redrawing the lines at the level of detail for the current depth range and size of the axes.
+        """
+        if self.plot_depth is None or len(self.plot_depth) == 0:
+            return
+        for ax, line, values in zip(self.fig.axes, self.lines, self.plot_values):
+            line_depth, line_data = self.getLevelOfDetail(ax, values, ax.get_ylim())
+            line.set_data(line_data, line_depth)
+
+    def onYlimChanged(self, ax:matplotlib.axes.Axes):
+        """
+        Event handler updating the level of detail of the lines when the graphs are zoomed or panned.
+        The figure is laid out again if the depth tick labels have become wider or narrower.
+        """
+        self.updateLevelOfDetail()
+        if self.layout_label_width is not None and self.getDepthLabelWidth() != self.layout_label_width:
+            self.scheduleLayout()
+
     def setPlotXlabel(self):
         """
         Function setting xlabel for the x-axis of the Colours Plot. 
@@ -131,30 +298,31 @@ class ColoursGraph(FigureCanvasQTAgg):
         Function preparing data to be plotted in the Colours Graph.
 
         Returns:
-            depth(pd.Series): depth of sample from geological core for row of data.
-            colour_data_list(list[pd.Series]): list of pd.Series objects containing the data for each colour channel of analysis.
+            depth(np.ndarray): depth of sample from geological core for row of data.
+            colour_data_list(list[np.ndarray]): list of arrays containing the data for each colour channel of analysis.
             colour_name_list(list[str]): the name of each colour channel in the analysis - used as headings for the colours graph subplots.
             plot_line_colour_list(list[str]): a list of strings passed to plt.plot to set the colour of the lines on the plot.
         """
         if self.analysis_type == 'rgb':
-            depth = self.df['Depth (mm)']
+            depth = self.profile['Depth (mm)']
             colour_name_list = ['Red',"Green",'Blue']
-            colour_data_list = [self.setDataUnits(self.df[colour_name]) for colour_name in colour_name_list]
+            colour_data_list = [self.setDataUnits(self.profile[colour_name]) for colour_name in colour_name_list]
             plot_line_colour_list = ['r',"g",'b']
         if self.analysis_type =='lab':
-            depth = self.df['Depth (mm)']
+            depth = self.profile['Depth (mm)']
             colour_name_list = ['L*',"A*",'B*']
-            colour_data_list = [self.df['L']]
-            for data in [self.setDataUnits(self.df[colour_name],colour_name) for colour_name in ['a','b']]:
+            colour_data_list = [self.profile['L']]
+            for data in [self.setDataUnits(self.profile[colour_name],colour_name) for colour_name in ['a','b']]:
                 colour_data_list.append(data)
             plot_line_colour_list = ['b','b','b']
         return depth,colour_data_list,colour_name_list,plot_line_colour_list
     
-    def setDataUnits(self,data:pd.Series,colour_name:str = None)->pd.Series:
+    def setDataUnits(self,data:np.ndarray,colour_name:str = None)->np.ndarray:
+        data = np.asarray(data, dtype=float) # the RGB channels are uint8, which would overflow
         if self.analysis_type =='rgb' and self.units == '%':
-            return round(100*data/255,4)
+            return np.round(100*data/255,4)
         elif self.analysis_type =='lab' and self.units == '%' and (colour_name =='a' or colour_name == 'b'):
-            return round(100*(data + 128)/255,4)
+            return np.round(100*(data + 128)/255,4)
         else:
             return data
 
@@ -210,23 +378,51 @@ class ColoursGraph(FigureCanvasQTAgg):
         """
         Add a title to the Colours Plot based of the type on analysis being visualised. 
         """
+        figure_title = self.getFigureTitle()
+        self.figure_title_fontsize = fontsize
+        self.fig.suptitle(figure_title, fontweight='bold',fontsize = fontsize) 
+
+    def getFigureTitle(self)->str:
+        """
+        Function returning the title of the Colours Plot for the type of analysis being visualised.
+        """
         if self.analysis_type == 'rgb':
-            figure_title = 'RGB Colour Space Plot'
+            return 'RGB Colour Space Plot'
         elif self.analysis_type == 'lab':
-            figure_title = 'CIELAB Colour Space Plot'
+            return 'CIELAB Colour Space Plot'
         else:
-            figure_title = ''
-        self.fig.suptitle(figure_title, fontweight='bold',fontsize = fontsize) 
+            return ''
         
     
     def resizeEvent(self,event):
         """
-        Event handler function that will adjust the graphical parameters of the 
-        matplotlib figure. 
+        Event handler resizing the matplotlib figure with the widget. 
+        
+        The layout of the figure is not recalculated for every resize event. Instead the
+        layout timer is restarted, so dragging or maximising the window lays the figure out
+        once, after the resizing has paused.
+        """
+        super().resizeEvent(event)
+        self.scheduleLayout()
+
+    def scheduleLayout(self):
+        """
+        Function (re)starting the layout timer. Also used by the LayersGraph, so that resizing 
+        both graphs results in a single layout pass.
+        """
+        self.layout_timer.start()
+
+    def applyLayout(self):
+        """
+        Function adjusting the graphical parameters of the matplotlib figure for its size. 
         
         There are two main changes: 
             1) changing font size
             2) turning tight layout on and off.
+
+        The axes positions found by tight layout are cached for each canvas size, analysis type, 
+        units and width of the depth tick labels, so returning to a previous size does not 
+        recalculate them.
         """
         #change font size if current font size and subplot width not below minimum values
         if self.verifyLabelGreaterThanMinFontSize():
@@ -234,12 +430,39 @@ class ColoursGraph(FigureCanvasQTAgg):
 
         #set tight_layout setting to figure if figure has dimensions
         if self.verifyTightLayout():
-            self.fig.tight_layout()
+            width, height = self.fig.get_size_inches() * self.fig.dpi
+            self.layout_label_width = self.getDepthLabelWidth()
+            key = (int(width), int(height), self.analysis_type, self.units, self.layout_label_width)
+            positions = self.layout_cache.get(key)
+            if positions is None:
+                self.fig.tight_layout()
+                positions = [ax.get_position() for ax in self.fig.axes]
+                self.layout_cache[key] = positions
+                if len(self.layout_cache) > self.layout_cache_size:
+                    self.layout_cache.popitem(last=False)
+            else:
+                for ax, position in zip(self.fig.axes, positions):
+                    ax.set_position(position)
+                self.layout_cache.move_to_end(key)
+
+        # The axes have a new height in pixels, so the level of detail changes
+        self.updateLevelOfDetail()
+
+        # Let other graphs (the layers strip) follow the new position of the axes
+        for listener in self.layout_listeners:
+            listener()
 
         # Redraw the figure
         self.draw_idle()
-        super().resizeEvent(event)
 
+    def getDepthLabelWidth(self)->int:
+        """
+        Function returning the number of characters in the widest depth tick label, which changes
+        the space tight layout leaves for the labels (e.g. when zooming out from "700" to "1400").
+        """
+        lower, upper = sorted(self.axes_left.get_ylim())
+        locs = [loc for loc in self.axes_left.yaxis.get_majorticklocs() if lower <= loc <= upper]
+        return max((len(label) for label in self.axes_left.yaxis.get_major_formatter().format_ticks(locs)), default=0)
 
     def setFontSize(self):
         """
@@ -0,0 +1,79 @@
+import matplotlib.axes
+import matplotlib.figure
+
+
+class DepthCursor():
+    """
+    A horizontal line across one or more axes of a figure that marks a depth, with an optional text readout.
+
+    The cursor is drawn by blitting: a copy of the figure without the cursor is captured after
+    every full draw (which only happens when the figure is resized, zoomed or panned), and moving
+    the cursor restores that copy and draws the cursor artists over it, without redrawing the plots.
+    """
+    def __init__(self, figure:matplotlib.figure.Figure):
+        self.figure = figure
+        self.lines = []
+        self.readout = None
+        self.background = None
+        self.figure.canvas.mpl_connect('draw_event', self.onDraw)
+
+    def setAxes(self, axes:list, readout_axes:matplotlib.axes.Axes = None):
+        """
+        Function creating the cursor artists on the given axes. Called again whenever the axes are cleared.
+        """
+        self.lines = [ax.axhline(0, color='grey', linewidth=1, alpha=0.8, animated=True, visible=False) for ax in axes]
+        self.readout = None
+        if readout_axes is not None:
+            # x is a fraction of the axes width and y is a depth, so the readout sits on the cursor line
+            self.readout = readout_axes.text(0.03, 0, '', transform=readout_axes.get_yaxis_transform(),
+                                             fontsize=8, va='bottom', ha='left', clip_on=False,
+                                             bbox=dict(facecolor='white', edgecolor='none', alpha=0.8, pad=1),
+                                             animated=True, visible=False)
+
+    def getArtists(self)->list:
+        return self.lines + ([self.readout] if self.readout is not None else [])
+
+    def setDepth(self, depth:float, text:str = None):
+        """
+        Function moving the cursor to a depth and showing text in the readout.
+        """
+        for line in self.lines:
+            line.set_ydata([depth, depth])
+            line.set_visible(True)
+        if self.readout is not None and text is not None:
+            self.readout.set_position((0.03, depth))
+            self.readout.set_text(text)
+            self.readout.set_visible(True)
+        self.blit()
+
+    def hide(self):
+        """
+        Function hiding the cursor.
+        """
+        if not any(artist.get_visible() for artist in self.getArtists()):
+            return
+        for artist in self.getArtists():
+            artist.set_visible(False)
+        self.blit()
+
+    def onDraw(self, event):
+        """
+        Event handler capturing the newly drawn figure as the background of the cursor.
+        """
+        self.background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+        self.drawArtists()
+
+    def blit(self):
+        """
+        Function restoring the background and drawing the cursor over it.
+        """
+        if self.background is None:
+            return # the cursor is drawn with the first full draw of the figure
+        self.figure.canvas.restore_region(self.background)
+        self.drawArtists()
+        self.figure.canvas.blit(self.figure.bbox)
+
+    def drawArtists(self):
+        for artist in self.getArtists():
+            if artist.get_visible() and artist.axes is not None:
+                self.figure.draw_artist(artist)
@@ -0,0 +1,81 @@
+from functools import partial
+from PyQt6.QtCore import QTimer
+
+
+class GraphLink():
+    """
+    Links the depth limits and depth cursors of two Graphs widgets, so that zooming, panning or
+    hovering over one core shows the same depths on the other.
+
+    Changes are not applied to the other graphs straight away. They are collected and applied
+    once per frame, so a drag that changes the limits many times between frames redraws the other
+    graphs at most once per frame, and the other cursor is only blitted at its latest position.
+    """
+    frame_interval_ms = 16
+
+    def __init__(self, graphs_left, graphs_right):
+        self.graphs = [graphs_left, graphs_right]
+        self.is_syncing = False
+        self.pending_limits = {}  # graphs to update -> depth limits
+        self.pending_cursors = {} # graphs to update -> cursor depth, or None to hide the cursor
+
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.frame_interval_ms)
+        self.timer.timeout.connect(self.flush)
+
+        self.connections = []
+        for graphs in self.graphs:
+            for ax in graphs.colours_graph.fig.axes:
+                self.connections.append((ax, ax.callbacks.connect('ylim_changed', partial(self.onYlimChanged, graphs))))
+            graphs.cursor_listeners.append(self.onCursorMoved)
+
+        # The right graphs start at the depth range of the left graphs
+        self.onYlimChanged(graphs_left, graphs_left.colours_graph.axes_left)
+
+    def getOther(self, graphs):
+        return self.graphs[1] if graphs is self.graphs[0] else self.graphs[0]
+
+    def onYlimChanged(self, graphs, ax):
+        """Queue the new depth limits of one graphs for the other."""
+        if self.is_syncing:
+            return
+        self.pending_limits[self.getOther(graphs)] = ax.get_ylim()
+        self.scheduleFlush()
+
+    def onCursorMoved(self, graphs, depth):
+        """Queue the cursor depth of one graphs for the other."""
+        self.pending_cursors[self.getOther(graphs)] = depth
+        self.scheduleFlush()
+
+    def scheduleFlush(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        """Apply the queued limits and cursors, redrawing each changed graphs once."""
+        pending_limits, self.pending_limits = self.pending_limits, {}
+        pending_cursors, self.pending_cursors = self.pending_cursors, {}
+        self.is_syncing = True
+        try:
+            for graphs, ylim in pending_limits.items():
+                if tuple(graphs.colours_graph.axes_left.get_ylim()) != tuple(ylim):
+                    graphs.colours_graph.axes_left.set_ylim(ylim)
+                    graphs.colours_graph.draw_idle()
+            for graphs, depth in pending_cursors.items():
+                if depth is None:
+                    graphs.hideCursor()
+                else:
+                    graphs.setCursorDepth(depth)
+        finally:
+            self.is_syncing = False
+
+    def remove(self):
+        """Disconnect the two graphs."""
+        self.timer.stop()
+        for ax, connection in self.connections:
+            ax.callbacks.disconnect(connection)
+        for graphs in self.graphs:
+            if self.onCursorMoved in graphs.cursor_listeners:
+                graphs.cursor_listeners.remove(self.onCursorMoved)
+        self.connections = []
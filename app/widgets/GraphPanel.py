@@ -14,13 +14,13 @@ class GraphPanel(QWidget):
     The PyQt class that defines the panel showing the graphs
     """
     
-    def __init__(self, parent=None, df=None, image=None):
+    def __init__(self, parent=None, profile=None, image=None):
         """
         The initialization function for the GraphPanel class/PyQt widget.
         """
         super().__init__(parent)
         self.graphs = None
-        self.df = df  # Store the dataframe directly
+        self.profile = profile  # The CoreProfile of the core, shared with the graphs
         self.image = image
         self.layout = QVBoxLayout(self)  # Create a layout for the GraphPanel
         self.init_empty()
@@ -48,9 +48,9 @@ class GraphPanel(QWidget):
             if widget:
                 widget.setParent(None)  # Remove old widget
 
-        # Ensure the dataframe (df) is used to generate the graphs
-        if self.df is not None:
-            self.graphs = Graphs(df=self.df)  # Pass the dataframe to the graph widget
+        # Ensure the profile is used to generate the graphs
+        if self.profile is not None:
+            self.graphs = Graphs(profile=self.profile)  # Pass the profile to the graph widget
         else:
             print("No dataframe provided. Please upload and process an image.")
         
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+
+
+class GraphPanelCache():
+    """
+    Keeps the GraphPanels of recently shown images, so that showing an image again reuses its
+    figures instead of building new ones.
+
+    The memory used by the cached panels is estimated from their figure buffers and plot data.
+    When it goes over `max_bytes`, the least recently shown panels are deleted, except for the
+    panels that are currently shown.
+    """
+    def __init__(self, max_bytes=512 * 1024**2):
+        self.max_bytes = max_bytes
+        self.panels = OrderedDict()  # image path -> GraphPanel, least recently shown first
+
+    def get(self, image_path, in_use=()):
+        """Return the cached panel of an image, or None if it is not cached or is already shown."""
+        panel = self.panels.get(image_path)
+        if panel is None or any(panel is other for other in in_use):
+            return None
+        self.panels.move_to_end(image_path)
+        return panel
+
+    def put(self, image_path, panel, in_use=()):
+        """Cache the panel of an image, then evict panels until the cache is within its budget."""
+        old_panel = self.panels.pop(image_path, None)
+        if old_panel is not None and old_panel is not panel and not any(old_panel is other for other in in_use):
+            self.discard(old_panel)
+        self.panels[image_path] = panel
+        self.evict(list(in_use) + [panel])
+
+    def contains(self, panel):
+        return any(panel is cached for cached in self.panels.values())
+
+    def invalidate(self, image_path, in_use=()):
+        """Forget the panel of an image, e.g. after its data has been recalculated."""
+        panel = self.panels.pop(image_path, None)
+        if panel is not None and not any(panel is other for other in in_use):
+            self.discard(panel)
+
+    def evict(self, in_use=()):
+        """Delete the least recently shown panels that are not in use until the cache is within its budget."""
+        total = self.get_size()
+        for image_path, panel in list(self.panels.items()):
+            if total <= self.max_bytes:
+                break
+            if any(panel is other for other in in_use):
+                continue
+            total -= self.get_panel_bytes(panel)
+            del self.panels[image_path]
+            self.discard(panel)
+
+    def get_size(self):
+        return sum(self.get_panel_bytes(panel) for panel in self.panels.values())
+
+    @staticmethod
+    def get_panel_bytes(panel):
+        """Estimate the memory used by the figures of a panel: their Agg and cursor background buffers, and plot data."""
+        graphs = panel.graphs
+        if graphs is None:
+            return 0
+        size = 0
+        for canvas in [graphs.colours_graph, graphs.layers_graph]:
+            width, height = canvas.get_width_height(physical=True)
+            size += 2 * 4 * width * height
+        for depth, colour_data_list, _, _ in graphs.colours_graph.plot_data_cache.values():
+            size += depth.nbytes + sum(colour_data.nbytes for colour_data in colour_data_list)
+        size += graphs.layers_graph.core_as_grid.nbytes
+        return size
+
+    @staticmethod
+    def discard(panel):
+        panel.setParent(None)
+        panel.deleteLater()
@@ -10,15 +10,23 @@ from app.widgets.Toolbar import Toolbar
 class Graphs(QWidget):
     """The pyqt class that defines the panel containing the colour graphs
     """
-    def __init__(self, parent=None, df = None):
+    def __init__(self, parent=None, profile = None):
         super().__init__(parent)
-        self.df = df
+        self.profile = profile
 
         #generate instances of the sediment graphs
-        self.colours_graph = ColoursGraph(self,dpi=60, df = self.df)
-        self.layers_graph  = LayersGraph(self, dpi=60, df = self.df)
+        self.colours_graph = ColoursGraph(self,dpi=60, profile = self.profile)
+        self.layers_graph  = LayersGraph(self, dpi=60, profile = self.profile)
         
         self.layers_graph.layers_axes.sharey(self.colours_graph.axes_left)
+        self.colours_graph.layout_listeners.append(self.layers_graph.followColoursAxes)
+
+        # A depth cursor follows the mouse over the colours graph and the layers strip
+        self.cursor_listeners = []  # called with (graphs, depth or None) when the mouse moves the cursor
+        for canvas in [self.colours_graph, self.layers_graph]:
+            canvas.mpl_connect('motion_notify_event', self.onMouseMove)
+            canvas.mpl_connect('figure_leave_event', self.onMouseLeave)
+
         self.init_ui()
 
     def init_ui(self):
@@ -38,4 +46,43 @@ class Graphs(QWidget):
         #Set the layout of this instance of the Graph Panel
         main_layout.setContentsMargins(3, 5, 5, 3)
         main_layout.setSpacing(3)   
-        self.setLayout(main_layout)
\ No newline at end of file
+        self.setLayout(main_layout)
+
+    def setOrientation(self):
+        """Show the graphs in the orientation of the profile, after it has been flipped."""
+        if self.colours_graph.flipped == self.profile.flipped:
+            return
+        self.layers_graph.setOrientation()
+        self.colours_graph.setOrientation()
+        self.colours_graph.draw_idle()
+        self.layers_graph.draw_idle()
+
+    def rescaleDepths(self, ratio):
+        """Show the graphs after the depths of the profile have been multiplied by `ratio`."""
+        self.layers_graph.setDepths()
+        self.colours_graph.rescaleDepths(ratio)
+        self.colours_graph.draw_idle()
+        self.layers_graph.draw_idle()
+
+    def onMouseMove(self, event):
+        """Move the depth cursor of both graphs to the depth under the mouse."""
+        depth = None if event.inaxes is None else event.ydata
+        if depth is None:
+            self.hideCursor()
+        else:
+            self.setCursorDepth(depth)
+        for listener in self.cursor_listeners:
+            listener(self, depth)
+
+    def onMouseLeave(self, event):
+        self.hideCursor()
+        for listener in self.cursor_listeners:
+            listener(self, None)
+
+    def setCursorDepth(self, depth):
+        self.colours_graph.showCursor(depth)
+        self.layers_graph.depth_cursor.setDepth(depth)
+
+    def hideCursor(self):
+        self.colours_graph.depth_cursor.hide()
+        self.layers_graph.depth_cursor.hide()
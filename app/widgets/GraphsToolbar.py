@@ -173,9 +173,9 @@ class GraphsToolbar(NavigationToolbar):
             if not file_name.endswith('.csv'):
                 file_name += '.csv'
 
-            df = self.parent.df
-            if df is not None:
-                df.to_csv(file_name, index=False)
+            profile = self.parent.profile
+            if profile is not None:
+                profile.to_dataframe().to_csv(file_name, index=False)
 
 
     # def export_data_to_excel(self):
@@ -197,8 +197,7 @@ class GraphsToolbar(NavigationToolbar):
     
     def toggle_units(self):
         self.parent.graphs.colours_graph.units = self.getNewUnit(self.parent.graphs.colours_graph.units)
-        self.parent.graphs.colours_graph.clearSubplots()
-        self.parent.graphs.colours_graph.plotColourData()
+        self.parent.graphs.colours_graph.replotColourData()
         self.parent.graphs.colours_graph.draw_idle()
 
     def getNewUnit(self, unit):
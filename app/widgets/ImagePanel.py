@@ -1,6 +1,6 @@
 from PyQt6.QtWidgets import QWidget, QVBoxLayout, QLabel
 from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QImage, QTransform
+from PyQt6.QtGui import QImage, QPixmap, QTransform
 import numpy as np
 
 from app.widgets.ImageToolbar import ImageToolbar
@@ -30,8 +30,12 @@ class ImagePanel(QWidget):
 
         self.setLayout(self.layout)
     
-    def set_image(self, pixmap):
-        """Set the given QPixmap on the image label."""
-        self.image = pixmap
-        self.image_label.setPixmap(pixmap.scaled(self.image_label.size(), Qt.AspectRatioMode.KeepAspectRatio))
+    def set_image(self, image):
+        """
+        Set the given QImage on the image label. The image may be a view of a shared array,
+        only the copy scaled to the label is converted to a QPixmap.
+        """
+        self.image = image
+        scaled = image.scaled(self.image_label.size(), Qt.AspectRatioMode.KeepAspectRatio)
+        self.image_label.setPixmap(QPixmap.fromImage(scaled))
         self.layout.insertWidget(0, self.toolbar)
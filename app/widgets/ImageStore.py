@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from PyQt6.QtGui import QImage
+import numpy as np
+
+from app.utils.ImageCache import ImageCache
+
+
+class ImageStore():
+    """
+    Keeps one decoded preview of each recently shown image, shared by every widget that shows it.
+
+    Widgets get QImages that are views of the stored arrays rather than copies. A view keeps its
+    array alive, so evicting an image from the store never invalidates a widget that is showing it.
+    When the stored arrays go over `max_bytes`, the least recently used ones are dropped.
+    """
+    def __init__(self, image_cache:ImageCache, max_bytes=256 * 1024**2):
+        self.image_cache = image_cache
+        self.max_bytes = max_bytes
+        self.arrays = OrderedDict()  # image path -> BGR preview, least recently used first
+
+    def get_array(self, image_path):
+        """Return the BGR preview of an image, or None if it could not be read."""
+        array = self.arrays.get(image_path)
+        if array is not None:
+            self.arrays.move_to_end(image_path)
+            return array
+        array = self.image_cache.get_image(image_path, self.image_cache.preview_size)
+        if array is None:
+            return None
+        self.put(image_path, array)
+        return array
+
+    def put(self, image_path, array):
+        """Store the preview of an image that has already been decoded, such as by its import."""
+        self.arrays[image_path] = array
+        self.arrays.move_to_end(image_path)
+        self.evict()
+
+    def get_image(self, image_path):
+        """Return a QImage view of the preview of an image, which is null if it could not be read."""
+        array = self.get_array(image_path)
+        return to_qimage(array) if array is not None else QImage()
+
+    def evict(self):
+        total = self.get_size()
+        for image_path, array in list(self.arrays.items())[:-1]:
+            if total <= self.max_bytes:
+                break
+            total -= array.nbytes
+            del self.arrays[image_path]
+
+    def get_size(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+
+def to_qimage(array:np.array)->QImage:
+    """
+    Function returning a QImage that shares the memory of a BGR uint8 array, without copying it.
+    The QImage holds a reference to the array, so the array lives at least as long as the QImage.
+    """
+    array = np.ascontiguousarray(array)
+    height, width = array.shape[:2]
+    return QImage(array, width, height, array.strides[0], QImage.Format.Format_BGR888)
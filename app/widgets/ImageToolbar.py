@@ -3,7 +3,6 @@ from PyQt6.QtWidgets import QApplication, QToolBar, QPushButton, QInputDialog, Q
 from PyQt6.QtGui import QPixmap, QAction,QTransform, QIcon
 from app.widgets.GraphPanel import GraphPanel
 import numpy as np
-from app.utils.ProcessSedimentCore import process_core_image
 
 from os import getcwd
 from PyQt6.QtGui import QAction
@@ -18,9 +17,6 @@ from app.widgets.ColoursGraph import ColoursGraph
 
 class ImageToolbar(QToolBar):
 
-    layers_graph_top_axes_label = 'Top'
-    layers_graph_bottom_axes_label = 'Bottom'
-
     def __init__(self, parent=None):
         super().__init__(parent)
         self.init_ui()
@@ -60,6 +56,10 @@ class ImageToolbar(QToolBar):
     
 
     def flip_image(self):
+        """
+        Flips the image, and the orientation of its profile in the graph panel shown beside it.
+        The profile's data is unchanged, the existing graphs are redrawn from the other end of the core.
+        """
         # Flipping the image in the image panel
         transform = QTransform().rotate(180) 
         img = self.parent().image
@@ -67,47 +67,23 @@ class ImageToolbar(QToolBar):
             img_flipped = img.transformed(transform)
             self.parent().set_image(img_flipped)
 
-            # Inverting the dataframe and re-showing the graphs
-            graph_panel = self.parent().parent().findChild(GraphPanel)
-            
-            max_depth = max(graph_panel.df['Depth (mm)'])
-            new_depths = graph_panel.df['Depth (mm)'].apply(lambda x: max_depth - x)
-            
-            graph_panel.df['Depth (mm)'] = new_depths
-            
-            graph_panel.init_ui()
-
-            self.flipTopBottomLabels()
-
-            graph_panel.graphs.layers_graph.layers_axes.set_xlabel(self.layers_graph_bottom_axes_label)
-            graph_panel.graphs.layers_graph.layers_axes_top.set_xlabel(self.layers_graph_top_axes_label)  
-
-    def flipTopBottomLabels(self):
-        """
-        Function to flip the location of the top and bottom labels on the layers graph.
-        """
-        self.layers_graph_top_axes_label = self.getNewLabel(self.layers_graph_top_axes_label)
-        self.layers_graph_bottom_axes_label = self.getNewLabel(self.layers_graph_bottom_axes_label)
-
-    def getNewLabel(self, label):
-        return {'Top': 'Bottom', 'Bottom': 'Top'}.get(label, '')
+            # The graph panel of the image is beside it in Single Image Analysis
+            graph_panel = self.parent().parent().parent().panel_right
+            if isinstance(graph_panel, GraphPanel) and graph_panel.profile is not None:
+                graph_panel.profile.flip()
+                if graph_panel.graphs is not None:
+                    graph_panel.graphs.setOrientation()
 
     def calibrate_image(self):
         """
-        Creates PyQt6 QInputDialog to prompt user for width of sediment core, then reloads graph display with the new width
+        Creates PyQt6 QInputDialog to prompt user for width of sediment core, then rescales the depths 
+        in the graph display to the new width (the image is not processed again)
         """
         main_window = self.parent().parent().parent()
         image_path = main_window.panel_left.image_path
-        image = main_window.panel_right.image
 
         if image_path:
             text, ok = QInputDialog.getText(self, "Sediment Core Analysis", "Please input the width of the core in the image (in mm):")
             if text and ok:
-                if text.isdigit():
-                    new_data = process_core_image(image, int(text), df=True)
-                    if new_data != 0:
-                        new_df = new_data["Colours"] 
-
-                        # Resets the graph_panel object/s correpsonding to the file_path/s 
-                        self.parent().parent().parent().reset_data(image_path, new_df, image)
-                        self.parent().parent().parent().update_graph_panel(image_path, "single")
\ No newline at end of file
+                if text.isdigit() and int(text) > 0:
+                    main_window.recalibrate({image_path: int(text)})
\ No newline at end of file
@@ -0,0 +1,172 @@
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+from concurrent.futures import CancelledError
+from functools import partial
+import cv2 as cv
+
+from app.utils.ImageTransforming import orient_array
+from app.utils.ProcessSedimentCore import process_core_image
+from app.utils.ProfileCache import ProfileCache
+from app.utils.ImageCache import ImageCache, shrink
+from app.utils.CoreProfile import CoreProfile
+
+
+class ImportCancelled(Exception):
+    """Raised inside an import when the user has cancelled it."""
+
+
+class ImportSignals(QObject):
+    """Signals sent from an import running in the thread pool to the GUI thread."""
+    progress = pyqtSignal(str, int)                # stage, percentage complete
+    finished = pyqtSignal(str, object, object, object)  # image path, CoreProfile, cropped core image, preview
+    failed = pyqtSignal(str, str)                  # image path, error message
+    cancelled = pyqtSignal(str)                    # image path
+
+
+class ImportWorker(QRunnable):
+    """
+    Reads and processes a sediment core image in a QThreadPool thread, so the GUI
+    stays responsive while the core is detected and its colours are measured.
+
+    The stages of the import are reported through `signals.progress`. Cancelling the
+    import stops it at the start of the next stage, and the result is then discarded.
+    """
+    stages = {
+        'Reading image': 0,
+        'Hashing image': 10,
+        'Detecting core': 20,
+        'Measuring layer colours': 60,
+        'Building profile': 85,
+    }
+
+    def __init__(self, image_path, core_width_mm=76, pyramid_level=2, cache=None, image_cache=None):
+        super().__init__()
+        self.image_path = image_path
+        self.core_width_mm = core_width_mm
+        self.pyramid_level = pyramid_level
+        self.cache = cache
+        self.image_cache = image_cache
+        self.is_cancelled = False
+        self.signals = ImportSignals()
+
+        # The worker is kept alive by whoever started it, not deleted by the pool
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        """Ask the import to stop at the start of its next stage."""
+        self.is_cancelled = True
+
+    def report(self, stage):
+        """Emit the progress of a stage, or stop the import if it has been cancelled."""
+        if self.is_cancelled:
+            raise ImportCancelled()
+        self.signals.progress.emit(stage, self.stages[stage])
+
+    def run(self):
+        """Import the image, emitting exactly one of `finished`, `failed` or `cancelled`."""
+        try:
+            self.report('Reading image')
+            image = cv.imread(self.image_path)
+            if image is None:
+                self.signals.failed.emit(self.image_path, 'The image could not be read')
+                return
+            # The preview is made from this decode, so the image is not decoded again to show it
+            preview = shrink(image, ImageCache.preview_size)
+            oriented_image = orient_array(image)
+
+            # Reopened scans are looked up in the profile cache by the hash of the file
+            image_hash = None
+            if self.cache is not None:
+                self.report('Hashing image')
+                image_hash = ProfileCache.hash_file(self.image_path)
+
+            data_dict = process_core_image(oriented_image, self.core_width_mm, df=False, pyramid_level=self.pyramid_level,
+                                           cache=self.cache, image_hash=image_hash, progress=self.report)
+            if type(data_dict) != dict:
+                self.signals.failed.emit(self.image_path, 'No core was detected')
+                return
+
+            self.report('Building profile')
+            profile = CoreProfile.from_colours(data_dict['Colours'], data_dict['Scale'])
+
+            if self.is_cancelled:
+                raise ImportCancelled()
+            self.signals.progress.emit('Done', 100)
+            self.signals.finished.emit(self.image_path, profile, data_dict['Image'], preview)
+            # The preview and thumbnail are written to disk after the image is shown, not before
+            if self.image_cache is not None:
+                self.image_cache.fill(self.image_path, preview)
+        except ImportCancelled:
+            self.signals.cancelled.emit(self.image_path)
+        except Exception as error:
+            self.signals.failed.emit(self.image_path, str(error))
+
+
+class ImportBatch(QObject):
+    """
+    Imports several images in an ImportPool, emitting `finished` or `failed` for each
+    image as soon as its worker completes, in whatever order they complete.
+
+    Cancelling the batch drops the images still queued and discards the results of
+    the images being processed. `done` is emitted once every image is accounted for.
+    """
+    progress = pyqtSignal(str, int)                # description, percentage complete
+    finished = pyqtSignal(str, object, object, object)  # image path, CoreProfile, cropped core image, preview
+    failed = pyqtSignal(str, str)                  # image path, error message
+    done = pyqtSignal()
+
+    # Sent from the pool's result thread and delivered in the GUI thread
+    completed = pyqtSignal(str, object, object)    # image path, core, error message
+
+    def __init__(self, pool, image_paths):
+        super().__init__()
+        self.pool = pool
+        self.image_paths = list(image_paths)
+        self.futures = []
+        self.num_completed = 0
+        self.is_cancelled = False
+        self.completed.connect(self.on_completed)
+
+    def start(self):
+        """Submit every image to the pool."""
+        self.progress.emit(f"Imported 0 of {len(self.image_paths)} images", 0)
+        for image_path in self.image_paths:
+            future = self.pool.submit(image_path)
+            future.add_done_callback(partial(self.collect, image_path))
+            self.futures.append(future)
+
+    def cancel(self):
+        """Drop the queued images and ignore the results of the rest."""
+        self.is_cancelled = True
+        for future in self.futures:
+            future.cancel()
+
+    def collect(self, image_path, future):
+        """
+        Copy a result out of shared memory (in the pool's thread) and pass it to the GUI thread,
+        then write its preview and thumbnail to the image cache, after the image is shown.
+        """
+        core, error = None, None
+        try:
+            core = self.pool.collect(future)
+        except CancelledError:
+            pass
+        except Exception as exception:
+            error = str(exception) or repr(exception)
+        self.completed.emit(image_path, core, error)
+        if isinstance(core, dict) and self.pool.image_cache is not None and not self.is_cancelled:
+            self.pool.image_cache.fill(image_path, core['Preview'])
+
+    def on_completed(self, image_path, core, error):
+        self.num_completed += 1
+        if not self.is_cancelled:
+            if error is not None:
+                self.failed.emit(image_path, error)
+            elif core == 0:
+                self.failed.emit(image_path, 'No core was detected')
+            elif core is not None:
+                self.finished.emit(image_path, core['Profile'], core['Image'], core['Preview'])
+
+        total = len(self.image_paths)
+        self.progress.emit(f"Imported {self.num_completed} of {total} images", int(100 * self.num_completed / total))
+        if self.num_completed == total:
+            self.done.emit()
@@ -2,11 +2,11 @@ import numpy as np
 import pandas as pd
 import matplotlib
 import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 matplotlib.use('QtAgg')
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
-from PyQt6.QtCore import QTimer
+
+from app.widgets.DepthCursor import DepthCursor
 
 class LayersGraph(FigureCanvasQTAgg):
     """A wrapper class for a Matplotlib plot of the sediment layers"""
@@ -14,17 +14,18 @@ class LayersGraph(FigureCanvasQTAgg):
     layers_title_max_fontsize = 12 
     layers_title_base_fontsize = 7
 
-    def __init__(self, parent=None, dpi=100, df = None):
+    def __init__(self, parent=None, dpi=100, profile = None):
         self.dpi = dpi
         self.parent = parent
-        self.df = df[['Depth (mm)','Red',"Green",'Blue']] 
-        height = len(df)
+        self.profile = profile
+        height = len(profile)
         width = 1
         self.core_as_grid = self.createCore_as_grid(height, width)
         top,bottom = self.parent.colours_graph.setTopBottomCoordinates()
         self.setLayersFigure(dpi,top,bottom)
 
-        self.layers_fig.canvas.mpl_connect('resize_event',self.resizeEvent)
+        self.depth_cursor = DepthCursor(self.layers_fig)
+        self.depth_cursor.setAxes([self.layers_axes])
         
         super(LayersGraph, self).__init__(self.layers_fig)
 
@@ -35,14 +36,11 @@ class LayersGraph(FigureCanvasQTAgg):
         a component of an RGB value.
 
         Parameters:
-            df(pd.Dataframe): the data to be rendered in the layers plot.
+            height(int): the number of layers in the profile.
+            width(int): the number of columns of the image.
         """
-        core_as_grid = np.zeros((height, width, 3), dtype=float)
-
-        for row in range(height):
-            for col in range(width):
-                for channel in range(3):
-                    core_as_grid[row][col][channel] = int(self.df.loc[row, self.df.columns[channel+1]])/255
+        rgb = self.profile.bgr[:, ::-1]
+        core_as_grid = np.repeat(rgb[:, np.newaxis, :] / 255, width, axis=1)
         return core_as_grid
     
     def setLayersFigure(self,dpi,top,bottom):
@@ -68,9 +66,16 @@ class LayersGraph(FigureCanvasQTAgg):
         Function setting the labels for the layers graph which indicate the top and bottom of the core (and thus 
         the direction of image processing / scanning).
         """
-        self.layers_axes.set_xlabel('Bottom',fontweight = fontweight,labelpad = labelpad)
+        bottom_label, top_label = self.getTopBottomLabels()
+        self.layers_axes.set_xlabel(bottom_label,fontweight = fontweight,labelpad = labelpad)
         self.layers_axes_top = self.layers_axes.twiny()
-        self.layers_axes_top.set_xlabel('Top',fontweight = fontweight,labelpad = labelpad)
+        self.layers_axes_top.set_xlabel(top_label,fontweight = fontweight,labelpad = labelpad)
+
+    def getTopBottomLabels(self)->tuple:
+        """
+        Function returning the labels below and above the layers graph, which swap when the core is flipped.
+        """
+        return ('Top', 'Bottom') if self.profile.flipped else ('Bottom', 'Top')
 
 
     def setCustomTicks(self,which:str,labelleft:bool,left:bool,labelbottom:bool,bottom:bool):
@@ -84,35 +89,58 @@ class LayersGraph(FigureCanvasQTAgg):
 
     def plotLayers(self):
         """
-        Function iterating through core as gird variable and plotting coloured rectangles
-        onto the layer plot axes to represent the core laminations. 
+        Function drawing the core as grid variable onto the layer plot axes as a single image, 
+        where each row of the image represents a core lamination. 
         """
-        depths = list(self.df['Depth (mm)'])
+        depths = self.profile['Depth (mm)']
         thickness = depths[1] - depths[0]
-        for i, color in enumerate(self.core_as_grid):
-            depth = depths[i]
-            rect = patches.Rectangle((0, depth), 1,  thickness, facecolor=color)
-            self.layers_axes.add_patch(rect)
 
-    def resizeEvent(self, event):
+        # Row i covers depths[i] to depths[i] + thickness, so the image spans from the first
+        # depth to the end of the last row (thickness is negative once the core is flipped)
+        ylim = self.layers_axes.get_ylim()
+        self.layers_image = self.layers_axes.imshow(self.core_as_grid, extent=(0, 1, depths[-1] + thickness, depths[0]),
+                                                    origin='upper', aspect='auto', interpolation='nearest')
+        self.layers_axes.set_ylim(ylim)
+
+    def setOrientation(self):
+        """
+        Function showing the layers in the current orientation of the profile after it has been flipped,
+        by moving the existing image to the new depths and swapping the top and bottom labels.
         """
-        Function which resizes graphical parameters of the LayersGraph 
-        as PyQt window is changed. There is a delayed run time for this function 
-        to allow for the ColoursGraph to fully render. Without doing this the layers graph
-        receives the wrong coordinates for the locaiton of the start and end points of the data.
+        self.setDepths()
+        bottom_label, top_label = self.getTopBottomLabels()
+        self.layers_axes.set_xlabel(bottom_label)
+        self.layers_axes_top.set_xlabel(top_label)
+
+    def setDepths(self):
+        """
+        Function moving the existing image of the layers to the current depths of the profile,
+        after it has been flipped or rescaled.
         """
-        # Call delayed function after 2 seconds
-        QTimer.singleShot(10, self.delayed_resize_logic)
+        depths = self.profile['Depth (mm)']
+        thickness = depths[1] - depths[0]
+        ylim = self.layers_axes.get_ylim()
+        self.layers_image.set_extent((0, 1, depths[-1] + thickness, depths[0]))
+        self.layers_axes.set_ylim(ylim)
 
-        # Initialise an instance of the new figure
+    def resizeEvent(self, event):
+        """
+        Function which resizes the LayersGraph with the PyQt window. The strip is positioned 
+        by followColoursAxes once the ColoursGraph has been laid out for its new size, so 
+        this only asks the ColoursGraph for a (debounced) layout.
+        """
         super().resizeEvent(event)
+        self.parent.colours_graph.scheduleLayout()
 
-    def delayed_resize_logic(self):
-        """ This method handles the delayed resizing logic. """
+    def followColoursAxes(self):
+        """
+        Function called after each layout of the ColoursGraph, which positions the strip to span 
+        the same height as the colours axes. The orientation of the depth axis is shared with the 
+        colours axes, so it is not changed here.
+        """
         if self.verifyDimensions():
             top, bottom = self.parent.colours_graph.setTopBottomCoordinates()
-            self.layers_axes.set_position([0.1, bottom, 0.8, (top - bottom)])
-            self.layers_axes.invert_yaxis()
+            self.layers_axes.set_position([0.1, min(top, bottom), 0.8, abs(top - bottom)])
             self.setFontSize()
         self.draw_idle()
 
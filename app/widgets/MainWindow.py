@@ -2,7 +2,7 @@ import sys
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QGridLayout, QHBoxLayout, QWidget, QSizePolicy, QFileDialog, QScrollArea, QDialog, QPushButton, QLabel
 )
-from PyQt6.QtGui import QPixmap, QGuiApplication
+from PyQt6.QtGui import QGuiApplication, QTransform
 from PyQt6.QtCore import Qt
 import pandas as pd
 from time import sleep
@@ -13,7 +13,13 @@ from app.widgets.Toolbar import Toolbar
 from app.widgets.GraphPanel import GraphPanel
 from app.widgets.ColoursGraph import ColoursGraph
 from app.widgets.ThumbnailPanel import ThumbnailPanel
-from app.widgets.Thumbnail import Thumbnail
+from app.widgets.GraphLink import GraphLink
+from app.widgets.GraphPanelCache import GraphPanelCache
+from app.utils.ProfileCache import ProfileCache
+from app.utils.ImageCache import ImageCache
+from app.widgets.ImageStore import ImageStore
+from app.utils.ImportPool import ImportPool
+from app.utils.ProcessSedimentCore import Scaling
 from matplotlib.backends.backend_pdf import PdfPages
 
 
@@ -27,7 +33,7 @@ class MainWindow(QMainWindow):
         self.setWindowFlags(self.windowFlags() | Qt.WindowType.WindowStaysOnTopHint)
 
         # State to track images, graphs, and thumbnails
-        self.image_history = []  # Track triples of image panels, graph panels, and thumbnails
+        self.image_history = []  # Track pairs of image paths and graph panels holding their data
         self.num_images = 0  # The number of active images i.e. 0, 1,..., or more
 
         # Initialising panel references
@@ -35,16 +41,35 @@ class MainWindow(QMainWindow):
         self.panel_right = None 
         self.thumbnail_panel = None
 
+        # Optional link between the depths shown by the left and right graph panels
+        self.link_panels = False
+        self.panel_link = None
+
+        # On-disk cache of processed cores, so reopening a scan skips detection and colour processing
+        self.profile_cache = ProfileCache()
+
+        # On-disk cache of the thumbnails and previews of images, so they are not made from the full images every session
+        self.image_cache = ImageCache()
+        # Decoded previews shared by the widgets showing each image
+        self.image_store = ImageStore(self.image_cache)
+
+        # Graph panels of recently shown images, so showing an image again reuses its figures
+        self.graph_panel_cache = GraphPanelCache()
+        self.analysis_type = 'rgb'
+
+        # Worker processes for opening several images at once, started now so they are warm
+        self.import_pool = ImportPool(cache=self.profile_cache, image_cache=self.image_cache)
+        self.import_pool.warm_up()
+
         # Set window properties
         self.set_window_properties()
 
         # Main layout
-        self.reset_central_widget()
+        self.init_central_widget()
 
         # Initialize toolbar and menu
         self.toolbar = Toolbar(self)
         self.menu = Menu(self)
-        self.thumbnail_panel = ThumbnailPanel(self)
 
         # Add toolbar and menu
         self.addToolBar(self.toolbar)
@@ -55,101 +80,124 @@ class MainWindow(QMainWindow):
 
 
 
-    def reset_central_widget(self):
-        """Reset the existing central widget."""
+    def closeEvent(self, event):
+        """Stop the import worker processes when the window is closed."""
+        self.import_pool.shutdown()
+        super().closeEvent(event)
+
+    def init_central_widget(self):
+        """
+        Create the central widget and its grid layout. The layout is kept for the whole session: 
+        the left and right slots are swapped by render_panels and thumbnails are appended to the 
+        thumbnail panel below them.
+        """
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
         self.main_layout = QGridLayout()
 
-    def add_image_and_graph_panel(self, image_path, df, image):
+        self.main_layout.setColumnStretch(0, 1)
+        self.main_layout.setColumnStretch(1, 1)
+        self.main_layout.setRowStretch(0, 5)
+        self.main_layout.setRowStretch(1, 1)
+
+        self.main_layout.setContentsMargins(0, 0, 0, 0)
+        self.main_layout.setSpacing(3)   
+
+        self.central_widget.setLayout(self.main_layout)
+
+    def add_image_and_graph_panel(self, image_path, profile, image, preview):
         """Handle image and graph upload."""
 
-        # Setting the self.thumbnail_panel before rendering
-        thumbnail = self.create_thumbnail(image_path)
-        self.thumbnail_panel = self.create_thumbnail_panel() 
-                                                             
-        image_panel = self.create_image_panel(image_path)
-        graph_panel = self.create_graph_panel(df, image)
-        self.image_history.append([image_panel, graph_panel, thumbnail])
+        # The preview decoded by the import is shown, rather than read again
+        self.image_store.put(image_path, preview)
 
-        self.render_panels()
-        self.num_images += 1
+        # Appending the image to the thumbnail panel, the left and right panels are unchanged
+        self.thumbnail_panel.add_image(image_path)
 
-        # Update the central widget layout with new thumbnails and panels
+        # The image panel is made when the image is shown, from the shared preview
+        graph_panel = GraphPanel(self, profile, image)  # Holds the data, its figures are built when it is shown
+        self.image_history.append([image_path, graph_panel])
+
+        self.num_images += 1
 
     def create_image_panel(self, image_path):
         """Create an instance of the image panel."""
         image_panel = ImagePanel(self)
-        pixmap = QPixmap(image_path)
-        image_panel.set_image(pixmap)
+        image = self.image_store.get_image(image_path)
+        # The image is shown the same way up as its profile
+        for history_path, data_panel in self.image_history:
+            if history_path == image_path and data_panel.profile.flipped:
+                image = image.transformed(QTransform().rotate(180))
+        image_panel.set_image(image)
         image_panel.image_path = image_path
         return image_panel
 
-    def create_graph_panel(self, df, image):
+    def create_graph_panel(self, profile, image):
         """Create an instance of the graph panel."""
-        graph_panel = GraphPanel(self, df, image)
+        graph_panel = GraphPanel(self, profile, image)
         graph_panel.init_ui()
         return graph_panel
 
-    def create_thumbnail(self, image_path):
-        """Create an instance of a thumbnail."""
-        thumbnail = Thumbnail(image_path, main_window=self)  # Pass main window reference
-        return thumbnail
-
     def create_thumbnail_panel(self):
-        """Create a thumbnail panel using the existing thumbnails."""
+        """Create a thumbnail panel listing the existing images."""
         thumbnail_panel = ThumbnailPanel(self)
-        for _, _, thumbnail in self.image_history:
-            thumbnail_panel.add_thumbnail(thumbnail)
+        for image_path, _ in self.image_history:
+            thumbnail_panel.add_image(image_path)
         return thumbnail_panel
 
 
     def render_panels(self):
-        """Draw the image, graph, and thumbnail panels."""
-        self.reset_central_widget()
-
-        num_empty_panels = 0
+        """
+        Show the left and right panels, replacing only the slots whose panel has changed.
+        Replaced panels are deleted, unless they are cached graph panels.
+        """
         if self.panel_left is None:
             self.panel_left = GraphPanel(self)
-            num_empty_panels += 1
         if self.panel_right is None:
             self.panel_right = GraphPanel(self)
-            num_empty_panels += 1
 
-        new_layout = QGridLayout()
-        # Always add left and right panels (whether image or graph)
-        new_layout.addWidget(self.panel_left, 0, 0, 1, 1)
-        new_layout.addWidget(self.panel_right, 0, 1, 1, 1)
-    
-        # Thumbnails at the bottom
-        self.thumbnail_panel = self.create_thumbnail_panel()
-        new_layout.addWidget(self.thumbnail_panel, 1, 0, 1, 2, alignment=Qt.AlignmentFlag.AlignLeft)
-    
-        new_layout.setColumnStretch(0, 1)
-        new_layout.setColumnStretch(1, 1)
-        new_layout.setRowStretch(0, 5)
-        new_layout.setRowStretch(1, 1)
-
-        new_layout.setContentsMargins(0, 0, 0, 0)
-        new_layout.setSpacing(3)   
-
-        self.central_widget.setLayout(new_layout)
-
-        self.showMaximized() # Fixes issue with window going out of bounds 
-
-        # Adjusting panel widths to be equal
-        if num_empty_panels == 2:
-            width_left = self.panel_left.width()
-            width_right = self.panel_right.width()
-            width_average = int(0.5*(width_left + width_right))
-            self.panel_left.setFixedWidth(width_average)
-            self.panel_right.setFixedWidth(width_average)
+        new_panels = [self.panel_left, self.panel_right]
+        old_panels = []
+        for column, panel in enumerate(new_panels):
+            item = self.main_layout.itemAtPosition(0, column)
+            old_panel = item.widget() if item is not None else None
+            if old_panel is not panel:
+                if old_panel is not None:
+                    self.main_layout.removeWidget(old_panel)
+                    old_panels.append(old_panel)
+                self.main_layout.addWidget(panel, 0, column, 1, 1)
+                panel.show()
+
+        for old_panel in old_panels:
+            if not any(old_panel is panel for panel in new_panels):
+                if self.graph_panel_cache.contains(old_panel):
+                    old_panel.setParent(None)
+                else:
+                    old_panel.deleteLater()
+
+        self.update_panel_link()
+
+    def set_panels_linked(self, linked):
+        """Turn the link between the left and right graph panels on or off."""
+        self.link_panels = linked
+        self.update_panel_link()
+
+    def update_panel_link(self):
+        """Link the graphs of the current left and right panels, if linking is on and both are graphs."""
+        if self.panel_link is not None:
+            self.panel_link.remove()
+            self.panel_link = None
+
+        panels = [self.panel_left, self.panel_right]
+        if self.link_panels and all(isinstance(panel, GraphPanel) and panel.graphs is not None for panel in panels):
+            self.panel_link = GraphLink(self.panel_left.graphs, self.panel_right.graphs)
 
     def set_empty_panels(self):
-        """Set the initial empty placeholder panels."""
+        """Set the initial empty placeholder panels and the thumbnail panel."""
         self.panel_left = ImagePanel(self)
         self.panel_right = GraphPanel(self)
         self.thumbnail_panel = self.create_thumbnail_panel()
+        self.main_layout.addWidget(self.thumbnail_panel, 1, 0, 1, 2)
         self.render_panels()
 
 
@@ -158,14 +206,8 @@ class MainWindow(QMainWindow):
     
         # Handle Single Image Analysis
         if panel_side == "single":
-        # Create an image panel for the left
-            self.panel_left = self.create_image_panel(image_path)
-        
-            # Find the corresponding graph panel for the image and assign it to the right
-            for _, graph_panel, thumbnail in self.image_history:
-                if thumbnail.image_path == image_path:
-                    self.panel_right = self.create_graph_panel(graph_panel.df, graph_panel.image)
-                    break
+            # Create an image panel for the left, and show the graph panel for the image on the right
+            self.set_panels(self.create_image_panel(image_path), self.get_graph_panel(image_path))
 
             # Re-render the panels with the new layout
             self.render_panels()
@@ -174,39 +216,74 @@ class MainWindow(QMainWindow):
             self.is_single_image_analysis = True
             return  # Exit early since this is single image analysis
 
-
-        # Find the `df` (dataframe) for the selected image based on the thumbnail
-        for _, graph_panel, thumbnail in self.image_history:
-            if thumbnail.image_path == image_path:
-                df = graph_panel.df  # Retrieve the dataframe from the graph panel
-                image = graph_panel.image
-                break
-
         # Existing logic for left or right panel
         if panel_side == "left":
-            self.panel_left = self.create_graph_panel(df, image)  # Use the retrieved `df`
-            self.thumbnail_panel = self.create_thumbnail_panel()
+            self.set_panels(self.get_graph_panel(image_path), self.panel_right)
 
         elif panel_side == "right":
-            self.panel_right = self.create_graph_panel(df, image)  # Use the retrieved `df`
-            self.thumbnail_panel = self.create_thumbnail_panel()
+            self.set_panels(self.panel_left, self.get_graph_panel(image_path))
     
 
         # Re-render the panels
         self.render_panels()
 
+    def get_graph_panel(self, image_path):
+        """
+        Return a graph panel for an image. The cached panel for the image is reused if there is one
+        and it is not already shown, otherwise a new panel is built from the image's data and cached.
+        """
+        in_use = [self.panel_left, self.panel_right]
+        graph_panel = self.graph_panel_cache.get(image_path, in_use)
+        if graph_panel is None:
+            for history_path, data_panel in self.image_history:
+                if history_path == image_path:
+                    graph_panel = self.create_graph_panel(data_panel.profile, data_panel.image)
+                    break
+        self.graph_panel_cache.put(image_path, graph_panel, in_use)
 
-    def reset_data(self, image_path, new_df, image):
-        index = 0
-        for image_panel, _, _ in self.image_history:
-            if (image_panel.image_path == image_path):
+        # Cached panels may have been showing a different analysis
+        colours_graph = graph_panel.graphs.colours_graph
+        if colours_graph.analysis_type != self.analysis_type:
+            colours_graph.analysis_type = self.analysis_type
+            colours_graph.replotColourData()
 
-                self.image_history[index][1] = GraphPanel(self, new_df, image)
-                self.panel_right = self.image_history[index][1]
-                break
+        # Or have been built before the core was flipped
+        graph_panel.graphs.setOrientation()
+        return graph_panel
 
-            index += 1
+    def set_panels(self, panel_left, panel_right):
+        """
+        Set the left and right panels to show on the next render_panels, and evict cached graph 
+        panels that are no longer shown if the cache is over its budget.
+        """
+        self.panel_left, self.panel_right = panel_left, panel_right
+        self.graph_panel_cache.evict([panel_left, panel_right])
 
+    def recalibrate(self, core_widths):
+        """
+        Change the width (in millimeters) of the cores in one or more images, given as a dictionary
+        of image path to width. Only the depths of a profile depend on the width, so they are rescaled
+        in place and the graphs showing them are updated, without processing the images again.
+        """
+        for image_path, data_panel in self.image_history:
+            if image_path not in core_widths:
+                continue
+            profile = data_panel.profile
+            old_scale = profile.get_scale()
+            # The cropped core is upright, so its width in pixels is its shorter side
+            scale = Scaling(core_widths[image_path]).get_mm_scale(min(data_panel.image.shape[:2]))
+            if old_scale == 0 or scale == old_scale:
+                continue
+            profile.rescale(scale)
+
+            # The panels sharing the profile (shown or cached) are updated rather than rebuilt
+            panels = [self.panel_left, self.panel_right, self.graph_panel_cache.panels.get(image_path)]
+            updated = []
+            for panel in panels:
+                if isinstance(panel, GraphPanel) and panel.profile is profile and panel.graphs is not None \
+                        and not any(panel is other for other in updated):
+                    panel.graphs.rescaleDepths(scale / old_scale)
+                    updated.append(panel)
 
 
     def clear_indicator_for_existing_panel(self, panel_side):
@@ -281,13 +358,13 @@ QToolButton:hover {
         the data. This is achieved through:
             1). Iterating over the two panels in the main window.
             2). Checking if these panels are GraphPanels (not Image Panels) and have been initialised.
-            3). Reploting graph panels according to the new type of analysis. 
+            3). Updating the existing lines of the graph panels with the data for the new type of analysis. 
         """
+        self.analysis_type = new_analysis_type
         for panel in [self.panel_left,self.panel_right]:
             if isinstance(panel,GraphPanel) and panel.graphs is not None:
                 panel.graphs.colours_graph.analysis_type = new_analysis_type
-                panel.graphs.colours_graph.clearSubplots()
-                panel.graphs.colours_graph.plotColourData()
+                panel.graphs.colours_graph.replotColourData()
                 panel.graphs.colours_graph.draw_idle()
     
 
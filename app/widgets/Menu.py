@@ -1,18 +1,20 @@
-from PyQt6.QtWidgets import QWidget, QFileDialog, QMenuBar, QMenu, QMessageBox
-from PyQt6.QtGui import QPixmap, QAction  
-from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import QWidget, QFileDialog, QMenuBar, QMenu, QMessageBox, QProgressDialog
+from PyQt6.QtGui import QAction  
+from PyQt6.QtCore import Qt, QThreadPool
 from PyQt6.QtGui import QDesktopServices
 from PyQt6.QtCore import QUrl
-import cv2 as cv
+import os
 import numpy as np
 from app.utils.ImageTransforming import * 
 from app.utils.ProcessSedimentCore import *   
 from app.widgets.GraphPanel import GraphPanel
+from app.widgets.ImportWorker import ImportWorker, ImportBatch
 
 class Menu(QMenuBar):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent = parent
+        self.imports = {}  # Running imports and batches, and their progress dialogs
         self.init_ui()
 
     def init_ui(self):
@@ -63,46 +65,89 @@ class Menu(QMenuBar):
 
     def open_image(self):
         """Open an image file and process it to display the image and its corresponding graph."""
-        # Open a file dialog to select an image file
-        file_name, _ = QFileDialog.getOpenFileName(
+        # Open a file dialog to select one or more image files
+        file_names, _ = QFileDialog.getOpenFileNames(
             self, 
-            "Open Image", 
+            "Open Images", 
             "", 
             "Images (*.png *.jpg *.bmp)"
         )
 
-        if file_name:
-            # Read the image using OpenCV
-            image = cv.imread(file_name)
-
-            if image is not None:
-                # Process the image (assuming orient_array and process_core_image are your utility functions)
-                oriented_image = orient_array(image)
-                display_image = QPixmap(file_name)
-
-                # Process the core image to get the data (df)
-                data_dict = process_core_image(oriented_image, 76)  # Use 76mm as core width
-
-                #checking image has been correctly processed
-                if type(data_dict) != dict:
-                    self.analysis_fail_popup()
-                    return
-                
-                #setting up dataframe for the colours graph
-                rgb_df = data_dict['Colours']
-                lab_df = core_to_lab(rgb_df)
-                df = pd.merge(rgb_df,lab_df,on = 'Depth (mm)')
-
-                if data_dict != 0:
-                    image = data_dict["Image"]
-                    
-                    # Call the MainWindow method to add the image and its graph
-                    self.parent.add_image_and_graph_panel(file_name, df, image)
-    
-    def analysis_fail_popup(self):
+        if len(file_names) == 1:
+            self.start_import(file_names[0])
+        elif len(file_names) > 1:
+            self.start_batch_import(file_names)
+
+    def start_import(self, file_name):
+        """Process an image in the thread pool, showing its progress in a dialog that can cancel it."""
+        worker = ImportWorker(file_name, 76, pyramid_level=2, cache=self.parent.profile_cache,
+                              image_cache=self.parent.image_cache)  # Use 76mm as core width
+
+        dialog = QProgressDialog(f"Importing {os.path.basename(file_name)}", "Cancel", 0, 100, self)
+        dialog.setWindowTitle("Importing Image")
+        dialog.setMinimumDuration(0)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.canceled.connect(worker.cancel)
+
+        worker.signals.progress.connect(lambda stage, percent: self.update_import_progress(dialog, stage, percent))
+        worker.signals.finished.connect(lambda *_: self.finish_import(worker))
+        worker.signals.finished.connect(self.parent.add_image_and_graph_panel)
+        worker.signals.failed.connect(lambda _, message: self.fail_import(worker, message))
+        worker.signals.cancelled.connect(lambda _: self.finish_import(worker))
+
+        # Keep references to running imports, otherwise the worker and dialog are garbage collected
+        self.imports[worker] = dialog
+        dialog.show()
+        QThreadPool.globalInstance().start(worker)
+
+    def start_batch_import(self, file_names):
+        """Process several images in the worker process pool, adding each one as soon as it is done."""
+        batch = ImportBatch(self.parent.import_pool, file_names)
+        failures = []
+
+        dialog = QProgressDialog(f"Importing {len(file_names)} images", "Cancel", 0, 100, self)
+        dialog.setWindowTitle("Importing Images")
+        dialog.setMinimumDuration(0)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.canceled.connect(batch.cancel)
+
+        batch.progress.connect(lambda description, percent: self.update_import_progress(dialog, description, percent))
+        batch.finished.connect(self.parent.add_image_and_graph_panel)
+        batch.failed.connect(lambda file_name, message: failures.append(f"{os.path.basename(file_name)}: {message}"))
+        batch.done.connect(lambda: self.finish_batch_import(batch, failures))
+
+        self.imports[batch] = dialog
+        dialog.show()
+        batch.start()
+
+    def finish_batch_import(self, batch, failures):
+        """Close the progress dialog of a batch and report the images that could not be imported."""
+        self.finish_import(batch)
+        if failures:
+            self.analysis_fail_popup("Some images could not be imported:\n" + "\n".join(failures))
+
+    def update_import_progress(self, dialog, stage, percent):
+        dialog.setLabelText(stage)
+        dialog.setValue(percent)
+
+    def finish_import(self, worker):
+        """Close the progress dialog of a finished or cancelled import or batch."""
+        dialog = self.imports.pop(worker, None)
+        if dialog is not None:
+            dialog.close()
+            dialog.deleteLater()
+
+    def fail_import(self, worker, message):
+        """Close the progress dialog of a failed import and report the error."""
+        self.finish_import(worker)
+        self.analysis_fail_popup(message)
+
+    def analysis_fail_popup(self, message='No core was detected'):
         msg = QMessageBox()
         msg.setWindowFlags(self.windowFlags() | Qt.WindowType.WindowStaysOnTopHint)
         msg.setWindowTitle('Error')
-        msg.setText('   No core was detected            ')
+        msg.setText(f'   {message}            ')
         msg.exec()
 
@@ -1,19 +1,209 @@
-import sys
-from PyQt6.QtWidgets import QApplication, QWidget, QStatusBar, QHBoxLayout, QLabel, QSizePolicy
-from PyQt6.QtGui import QPixmap
-from PyQt6.QtCore import Qt
-from app.widgets.Thumbnail import Thumbnail
+from collections import OrderedDict
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QStyle, QDialog, QPushButton, QGridLayout, QAbstractItemView
+from PyQt6.QtGui import QPixmap, QColor, QFontMetrics
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QRect, QThreadPool
 
-class ThumbnailPanel(QWidget):
+from app.widgets.Thumbnail import ThumbnailLoader
+from app.utils.ImageCache import ImageCache
+
+
+class ThumbnailModel(QAbstractListModel):
+    """
+    List of the opened images, with their thumbnails and the "Left"/"Right" indicators.
+
+    Thumbnails are loaded in the background the first time the view asks for them, which it
+    only does for the items on screen. Loaded thumbnails are kept in a cache of at most
+    `cache_size` pixmaps, and are loaded again if they have been evicted when they are next shown.
+    """
+    IndicatorRole = Qt.ItemDataRole.UserRole + 1
+    thumbnail_size = QSize(ImageCache.thumbnail_size, ImageCache.thumbnail_size)
+    cache_size = 256
+
+    def __init__(self, image_cache, parent=None):
+        super().__init__(parent)
+        self.image_cache = image_cache
+        self.image_paths = []
+        self.indicators = {}          # panel side -> image path
+        self.pixmaps = OrderedDict()  # image path -> thumbnail, least recently shown first
+        self.loaders = {}             # image path -> loader of the thumbnails being loaded
+        self.unreadable = set()       # images whose thumbnail could not be read, so are not retried
+        self.load_count = 0
+
+        # A pool of its own, so thumbnails load while images are being imported
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(2)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.image_paths)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        image_path = self.image_paths[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return image_path.split("/")[-1].split(".")[0]
+        if role == Qt.ItemDataRole.DecorationRole:
+            return self.get_pixmap(image_path)
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return image_path
+        if role == self.IndicatorRole:
+            for panel_side, indicated_path in self.indicators.items():
+                if indicated_path == image_path:
+                    return panel_side.capitalize()
+        return None
+
+    def add_image(self, image_path):
+        row = len(self.image_paths)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.image_paths.append(image_path)
+        self.endInsertRows()
+
+    def set_indicator(self, image_path, panel_side):
+        """Show a "Left" or "Right" indicator on an image, moving it from the image that had it."""
+        if panel_side not in ("left", "right"):
+            panel_side = None
+        changed = [path for side, path in self.indicators.items() if path == image_path or side == panel_side]
+        self.indicators = {side: path for side, path in self.indicators.items() if path != image_path and side != panel_side}
+        if panel_side is not None:
+            self.indicators[panel_side] = image_path
+        for path in set(changed + [image_path]):
+            self.update_image(path)
+
+    def get_pixmap(self, image_path):
+        """Return the thumbnail of an image, or None and start loading it if it is not in the cache."""
+        pixmap = self.pixmaps.get(image_path)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(image_path)
+            return pixmap
+        if image_path not in self.loaders and image_path not in self.unreadable:
+            loader = ThumbnailLoader(image_path, self.thumbnail_size, self.image_cache)
+            self.loaders[image_path] = loader
+            loader.signals.loaded.connect(self.on_loaded)
+            # The most recently requested thumbnails are loaded first, as they are the ones on screen
+            self.load_count += 1
+            self.thread_pool.start(loader, self.load_count)
+        return None
+
+    def on_loaded(self, image_path, image):
+        self.loaders.pop(image_path, None)
+        if image.isNull():
+            self.unreadable.add(image_path)
+            return
+        self.pixmaps[image_path] = QPixmap.fromImage(image)
+        while len(self.pixmaps) > self.cache_size:
+            self.pixmaps.popitem(last=False)
+        self.update_image(image_path)
+
+    def update_image(self, image_path):
+        for row, path in enumerate(self.image_paths):
+            if path == image_path:
+                index = self.index(row)
+                self.dataChanged.emit(index, index)
+
+
+class ThumbnailDelegate(QStyledItemDelegate):
+    """Paints a thumbnail with its indicator above it and the image name below it."""
+    indicator_height = 16
+    caption_height = 18
+    padding = 5
+
+    def sizeHint(self, option, index):
+        size = ThumbnailModel.thumbnail_size
+        return QSize(size.width() + 2 * self.padding,
+                     self.indicator_height + size.height() + self.caption_height + 2 * self.padding)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        rect = option.rect.adjusted(2, 2, -2, -2)
+        background = QColor(255, 255, 255, 200) if option.state & QStyle.StateFlag.State_MouseOver else QColor(255, 255, 255, 150)
+        painter.fillRect(rect, background)
+
+        indicator = index.data(ThumbnailModel.IndicatorRole)
+        if indicator:
+            indicator_rect = QRect(rect.left(), rect.top(), rect.width(), self.indicator_height)
+            painter.fillRect(indicator_rect, QColor("#8a4c57"))
+            painter.setPen(QColor("white"))
+            painter.drawText(indicator_rect, Qt.AlignmentFlag.AlignCenter, indicator)
+
+        image_rect = QRect(rect.left() + self.padding, rect.top() + self.indicator_height,
+                           rect.width() - 2 * self.padding, ThumbnailModel.thumbnail_size.height())
+        pixmap = index.data(Qt.ItemDataRole.DecorationRole)
+        if pixmap is not None:
+            size = pixmap.deviceIndependentSize().toSize()
+            left = image_rect.left() + (image_rect.width() - size.width()) // 2
+            top = image_rect.top() + (image_rect.height() - size.height()) // 2
+            painter.drawPixmap(left, top, pixmap)
+
+        caption_rect = QRect(rect.left(), image_rect.bottom(), rect.width(), self.caption_height)
+        caption = QFontMetrics(option.font).elidedText(index.data(), Qt.TextElideMode.ElideLeft, caption_rect.width())
+        painter.setPen(option.palette.color(option.palette.ColorRole.Text))
+        painter.drawText(caption_rect, Qt.AlignmentFlag.AlignCenter, caption)
+        painter.restore()
+
+
+class ThumbnailPanel(QListView):
+    """
+    Horizontal, scrollable strip of the opened images. Clicking a thumbnail asks which panel to show the image in.
+    """
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.main_window = parent
+
+        self.thumbnail_model = ThumbnailModel(parent.image_cache, self)
+        self.setModel(self.thumbnail_model)
+        delegate = ThumbnailDelegate(self)
+        self.setItemDelegate(delegate)
+
+        self.setFlow(QListView.Flow.LeftToRight)
+        self.setWrapping(False)
+        self.setUniformItemSizes(True)
+        self.setHorizontalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.setMouseTracking(True)
+        self.setStyleSheet("QListView {background-color: transparent; border: none;}")
+
+        item_height = delegate.sizeHint(None, None).height()
+        self.setFixedHeight(item_height + self.horizontalScrollBar().sizeHint().height() + 2 * self.frameWidth())
+
+        self.clicked.connect(self.show_panel_selection_dialog)
+
+    @property
+    def count(self):
+        return self.thumbnail_model.rowCount()
+
+    def add_image(self, image_path):
+        self.thumbnail_model.add_image(image_path)
+
+    def set_indicator(self, image_path, panel_side):
+        self.thumbnail_model.set_indicator(image_path, panel_side)
+
+    def show_panel_selection_dialog(self, index):
+        """Show the dialog to choose Left, Right, or Single Image Analysis panel."""
+        image_path = self.thumbnail_model.image_paths[index.row()]
+        dialog = QDialog(self)
+        dialog.resize(200, 80)
+        dialog.setWindowTitle("Select panel to display:")
+        layout = QGridLayout()
+
+        left_button = QPushButton("Left graph")
+        right_button = QPushButton("Right graph")
+        single_analysis_button = QPushButton("Image and graph")
+
+        layout.addWidget(left_button, 0, 0, 1, 1)
+        layout.addWidget(right_button, 0, 1, 1, 1)
+        layout.addWidget(single_analysis_button, 1, 0, 1, 0)
+
+        left_button.clicked.connect(lambda: self.select_panel(image_path, "left", dialog))
+        right_button.clicked.connect(lambda: self.select_panel(image_path, "right", dialog))
+        single_analysis_button.clicked.connect(lambda: self.select_panel(image_path, "single", dialog))
 
-        self.count = 0
-        self.layout = QHBoxLayout()
-        self.setLayout(self.layout)
+        dialog.setLayout(layout)
+        dialog.exec()
 
+    def select_panel(self, image_path, panel_side, dialog):
+        """Update the graph panel based on the selected side (left or right)."""
+        if self.main_window:
+            self.main_window.update_graph_panel(image_path, panel_side)
+            self.set_indicator(image_path, panel_side)
 
-    def add_thumbnail(self, thumbnail):
-        self.layout.addWidget(thumbnail, alignment=Qt.AlignmentFlag.AlignLeft)
-        self.count += 1
-    
+        dialog.accept()
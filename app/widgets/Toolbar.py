@@ -19,6 +19,12 @@ class Toolbar(QToolBar):
 
         self.run_cielab.triggered.connect(self.parent().run_lab)
         self.run_rgb.triggered.connect(self.parent().run_rgb)
+
+        # Linking keeps the depths shown by the left and right graphs in step
+        self.link_graphs = QAction("Link Graphs", self)
+        self.link_graphs.setCheckable(True)
+        self.addAction(self.link_graphs)
+        self.link_graphs.toggled.connect(self.parent().set_panels_linked)
         
 
 
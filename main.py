@@ -6,11 +6,14 @@
 # nuitka-project: --include-data-dir=app/style=app/style
 
 import sys
-from PyQt6.QtWidgets import QApplication
-from app.widgets.MainWindow import MainWindow
 
 def main():
     """Main entry point for the application."""
+    # Imported here, since the spawned import workers import this module again
+    # and must not load Qt
+    from PyQt6.QtWidgets import QApplication
+    from app.widgets.MainWindow import MainWindow
+
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()